@@ -1,11 +1,17 @@
-from fastapi import Header
+from fastapi import Header, HTTPException
 
+from utils.jwtVerify import TokenError, jwt_verifier
 
-async def get_current_user(supabase_access_token: str = Header(...)) -> str:
-    from utils.supabaseUtils import supabase_func_instance
 
+async def get_current_user(supabase_access_token: str = Header(...)) -> str:
     """Verifies Supabase access token and retrieves user_id."""
-    print("This is the access token", supabase_access_token)
-    response = await supabase_func_instance.getUserId(accessToken=supabase_access_token)
-    userid = response["UserID"]
-    return userid
+    try:
+        return await jwt_verifier.get_user_id(supabase_access_token)
+    except TokenError as e:
+        raise HTTPException(
+            status_code=401,
+            detail={
+                "error": "token_expired" if e.expired else "authentication_failed",
+                "message": str(e),
+            },
+        )
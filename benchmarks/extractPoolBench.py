@@ -0,0 +1,83 @@
+"""
+Scaling of utils.extractPool across worker counts on the newsletter corpus.
+
+Each corpus document is encoded as a Gmail body part and repeated to form a
+workload; every run converts the whole workload through `ExtractPool.extract`
+(as the content fetcher does, one call per email) and also reports the worst
+event-loop stall seen while it ran. Worker count 0 is the inline baseline.
+
+Usage: python -m benchmarks.extractPoolBench [--copies 25] [--workers 0 1 2 4 8]
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import time
+
+from benchmarks.htmlExtractBench import CORPUS_DIR, load_corpus
+from utils.extractPool import EXTRACT_POOL_CHUNK, ExtractPool
+
+
+def build_workload(documents, copies):
+    items = []
+    for _ in range(copies):
+        for doc in documents:
+            data = base64.urlsafe_b64encode(doc.encode("utf-8")).decode("ascii")
+            items.append((data, "text/html", "utf-8"))
+    return items
+
+
+async def watch_loop(stop: asyncio.Event, interval: float = 0.001) -> float:
+    """Return the longest gap between two wake-ups of a short periodic timer."""
+    worst = 0.0
+    while not stop.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - before - interval)
+    return worst
+
+
+async def run(items, workers, chunk_size):
+    pool = ExtractPool(workers=workers, chunk_size=chunk_size, min_bytes=0)
+    try:
+        if workers:
+            await pool.extract_many(items[: workers * chunk_size])  # Start workers
+
+        stop = asyncio.Event()
+        watcher = asyncio.create_task(watch_loop(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(pool.extract(*item) for item in items))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        return elapsed, await watcher
+    finally:
+        pool.shutdown()
+
+
+async def main(args):
+    items = build_workload(load_corpus(args.corpus), args.copies)
+    total_bytes = sum(len(data) for data, _, _ in items)
+    print(
+        f"Workload: {len(items)} bodies, {total_bytes / (1024 * 1024):.1f} MiB, "
+        f"{os.cpu_count()} CPUs, chunk size {args.chunk}"
+    )
+    print(f"{'workers':>7} {'docs/s':>9} {'speedup':>8} {'max stall ms':>13}")
+
+    baseline = None
+    for workers in args.workers:
+        elapsed, stall = await run(items, workers, args.chunk)
+        baseline = baseline or elapsed
+        print(
+            f"{workers or 'inline':>7} {len(items) / elapsed:>9.1f} "
+            f"{baseline / elapsed:>7.2f}x {stall * 1000:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", default=CORPUS_DIR)
+    parser.add_argument("--copies", type=int, default=25)
+    parser.add_argument("--chunk", type=int, default=EXTRACT_POOL_CHUNK)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4, 8])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+"""
+Throughput and output-equivalence of the HTML-to-text backends in
+utils.htmlExtract, measured on the anonymized newsletter corpus.
+
+Usage: python -m benchmarks.htmlExtractBench [--iterations 20]
+"""
+
+import argparse
+import glob
+import os
+import time
+from difflib import SequenceMatcher
+
+from utils.htmlExtract import EXTRACTORS, clean_text
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+# Strings that only appear inside <script>/<style>/hidden markup in the corpus
+LEAK_MARKERS = ("dataLayer", "@media", "schema.org", "View this email in your browser")
+
+
+def load_corpus(corpus_dir: str = CORPUS_DIR):
+    documents = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.html"))):
+        with open(path, "r", encoding="utf-8") as f:
+            documents.append(f.read())
+    return documents
+
+
+def similarity(reference: str, text: str) -> float:
+    return SequenceMatcher(
+        None, reference.split(), text.split(), autojunk=False
+    ).ratio()
+
+
+def main(args):
+    documents = load_corpus(args.corpus)
+    total_bytes = sum(len(doc.encode("utf-8")) for doc in documents)
+    reference = [clean_text(EXTRACTORS["bs4"](doc)) for doc in documents]
+    print(f"Corpus: {len(documents)} documents, {total_bytes / 1024:.0f} KiB")
+    print(
+        f"{'backend':<8} {'docs/s':>9} {'MiB/s':>7} {'similarity':>11} {'leaky docs':>11}"
+    )
+
+    for name, extract in EXTRACTORS.items():
+        try:
+            outputs = [clean_text(extract(doc)) for doc in documents]  # Warm-up
+        except ImportError as e:
+            print(f"{name:<8} skipped ({e})")
+            continue
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            for doc in documents:
+                clean_text(extract(doc))
+        elapsed = time.perf_counter() - start
+
+        docs_per_sec = len(documents) * args.iterations / elapsed
+        mib_per_sec = total_bytes * args.iterations / elapsed / (1024 * 1024)
+        score = sum(map(similarity, reference, outputs)) / len(documents)
+        leaky = sum(any(marker in text for marker in LEAK_MARKERS) for text in outputs)
+        print(
+            f"{name:<8} {docs_per_sec:>9.1f} {mib_per_sec:>7.2f} {score:>11.3f} {leaky:>11}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", default=CORPUS_DIR)
+    parser.add_argument("--iterations", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,124 @@
+"""
+Fire a burst of refine calls with a few episode calls behind them at the
+offline OpenAI fake, once straight through the OpenAI client (its own
+retries honor retry-after) and once through the LLM scheduler, and compare
+429s, wall time and how long the episode calls took.
+
+Episodes default to the production episode model, which has its own limits,
+so they only queue behind refines with --episode-model gpt-4o-mini.
+
+Usage: python -m benchmarks.llmSchedulerBench [--refines 40] [--episodes 3] [--tpm 20000]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from openai import AsyncOpenAI
+
+from fakes.fakeOpenAI import FakeOpenAITransport
+from utils.llmScheduler import PRIORITY_EPISODE, PRIORITY_REFINE, LLMScheduler
+
+# The models aiProcessingUtils uses
+REFINE_MODEL = "gpt-4o-mini"
+EPISODE_MODEL = "gpt-4o"
+
+
+def make_calls(args):
+    newsletter = "A sentence from a newsletter about markets. " * args.prompt_words
+    refines = [
+        dict(
+            model=REFINE_MODEL,
+            messages=[{"role": "system", "content": f"{i} {newsletter}"}],
+            temperature=0,
+        )
+        for i in range(args.refines)
+    ]
+    episodes = [
+        dict(
+            model=args.episode_model,
+            messages=[{"role": "user", "content": newsletter}],
+            temperature=0,
+            response_format={"type": "json_object"},
+        )
+        for _ in range(args.episodes)
+    ]
+    return refines, episodes
+
+
+async def run(args, scheduled: bool):
+    transport = FakeOpenAITransport(rpm=args.rpm, tpm=args.tpm, latency=args.latency)
+    limits = {"rpm": args.rpm, "tpm": args.tpm}
+    scheduler = LLMScheduler({REFINE_MODEL: limits, args.episode_model: limits})
+    await scheduler.set_transport(transport)
+    direct = AsyncOpenAI(
+        api_key="benchmark", http_client=httpx.AsyncClient(transport=transport)
+    )
+    refines, episodes = make_calls(args)
+
+    async def call(kwargs, priority):
+        started = time.perf_counter()
+        try:
+            if scheduled:
+                await scheduler.create(priority=priority, **kwargs)
+            else:
+                await direct.chat.completions.create(**kwargs)
+            return time.perf_counter() - started, True
+        except Exception:
+            return time.perf_counter() - started, False
+
+    async def episodes_later():
+        await asyncio.sleep(args.episode_delay)
+        return await asyncio.gather(*(call(e, PRIORITY_EPISODE) for e in episodes))
+
+    start = time.perf_counter()
+    refine_results, episode_results = await asyncio.gather(
+        asyncio.gather(*(call(r, PRIORITY_REFINE) for r in refines)),
+        episodes_later(),
+    )
+    elapsed = time.perf_counter() - start
+    await scheduler.aclose()
+    await direct.close()
+
+    episode_seconds = [s for s, _ in episode_results]
+    return {
+        "seconds": elapsed,
+        "rate_limited": transport.stats["rate_limited"],
+        "failed": sum(not ok for _, ok in refine_results + episode_results),
+        "episode_avg": statistics.mean(episode_seconds) if episode_seconds else 0,
+        "episode_max": max(episode_seconds, default=0),
+    }
+
+
+async def main(args):
+    print(
+        f"{args.refines} refine + {args.episodes} episode calls, "
+        f"limits {args.rpm} RPM / {args.tpm} TPM per model"
+    )
+    print(
+        f"{'mode':<10} {'seconds':>8} {'429s':>6} {'failed':>7} "
+        f"{'episode avg':>12} {'episode max':>12}"
+    )
+    for name, scheduled in (("direct", False), ("scheduled", True)):
+        r = await run(args, scheduled)
+        print(
+            f"{name:<10} {r['seconds']:>8.2f} {r['rate_limited']:>6} {r['failed']:>7} "
+            f"{r['episode_avg']:>12.2f} {r['episode_max']:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--refines", type=int, default=40)
+    parser.add_argument("--episodes", type=int, default=3)
+    # Limits are per model, so episodes only compete with refines (and
+    # priority only matters) when --episode-model is set to the refine model
+    parser.add_argument("--episode-model", default=EPISODE_MODEL)
+    parser.add_argument("--rpm", type=int, default=500)
+    parser.add_argument("--tpm", type=int, default=20000)
+    parser.add_argument("--prompt-words", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--episode-delay", type=float, default=0.1)
+    asyncio.run(main(parser.parse_args()))
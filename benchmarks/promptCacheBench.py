@@ -0,0 +1,95 @@
+"""
+Measure the prompt-cache hit rate and call latency of the refine and
+episode prompt layouts against the offline OpenAI fake, which caches
+prompt prefixes the way the API does (1024 tokens minimum, 128-token steps).
+
+"interpolated" puts the instructions and the content in one system message
+(the old refine layout). "prefix" sends the instructions as the system
+message and the content as the user message (refine_messages /
+episode_messages). --extra-instructions pads the instructions to show what
+happens once they are long enough to be cached.
+
+Usage: python -m benchmarks.promptCacheBench [--calls 50] [--extra-instructions 0]
+"""
+
+import argparse
+import asyncio
+import time
+
+from fakes.fakeOpenAI import FakeOpenAITransport, estimate_tokens
+from utils.episodePrompt import episodePrompt
+from utils.llmScheduler import LLMScheduler
+from utils.refineTextPrompt import prompt
+
+FILLER = "Keep every sentence exactly as written in the original newsletter. "
+
+
+def interpolated(instructions: str, content: str) -> list:
+    return [{"role": "system", "content": f"{instructions}\n{content}"}]
+
+
+def prefix(instructions: str, content: str) -> list:
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": content},
+    ]
+
+
+def newsletter(i: int, words: int) -> str:
+    return f"Original Text:\nIssue {i}. " + " ".join(
+        f"story{i}-{w}" for w in range(words)
+    )
+
+
+async def run(instructions: str, layout, args) -> dict:
+    transport = FakeOpenAITransport(
+        latency=args.latency, seconds_per_prompt_token=args.prefill
+    )
+    scheduler = LLMScheduler({"gpt-4o-mini": {"rpm": 10**6, "tpm": 10**9}})
+    await scheduler.set_transport(transport)
+
+    latencies = []
+    for i in range(args.calls):
+        started = time.perf_counter()
+        await scheduler.create(
+            model="gpt-4o-mini",
+            messages=layout(instructions, newsletter(i, args.words)),
+            temperature=0,
+        )
+        latencies.append(time.perf_counter() - started)
+    await scheduler.aclose()
+
+    stats = transport.stats
+    return {
+        "hit_rate": stats["cached_tokens"] / stats["prompt_tokens"],
+        "avg_ms": sum(latencies) / len(latencies) * 1000,
+    }
+
+
+async def main(args):
+    padding = FILLER * (args.extra_instructions * 4 // len(FILLER) + 1)
+    padding = padding[: args.extra_instructions * 4]
+    prompts = {"refine": prompt + padding, "episode": episodePrompt + padding}
+
+    print(f"{args.calls} calls per row, {args.words} words of content each")
+    print(
+        f"{'prompt':<8} {'layout':<13} {'instr tokens':>12} {'hit rate':>9} {'avg ms':>8}"
+    )
+    for name, instructions in prompts.items():
+        for layout in (interpolated, prefix):
+            r = await run(instructions, layout, args)
+            print(
+                f"{name:<8} {layout.__name__:<13} {estimate_tokens(instructions):>12} "
+                f"{r['hit_rate']:>9.1%} {r['avg_ms']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--extra-instructions", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.01)
+    # Seconds of prefill per uncached prompt token
+    parser.add_argument("--prefill", type=float, default=0.00005)
+    asyncio.run(main(parser.parse_args()))
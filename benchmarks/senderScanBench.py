@@ -0,0 +1,89 @@
+"""
+Compare the sender discovery scan with full-message fetches against the
+metadata-only header projection, using the recorded mailbox fixture served by
+the offline Gmail fake.
+
+Usage: python -m benchmarks.senderScanBench [--copies 5] [--latency 0.05]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from controllers.fetchEmailSenders import FetchEmailSenders
+from fakes.fakeGmail import FakeGmailTransport, load_mailbox
+from utils.gmailBatch import gmail_batcher
+from utils.gmailClient import gmail_client
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "mailbox.json")
+
+
+def expand_mailbox(messages, copies):
+    """Repeat the fixture under fresh message IDs to simulate a larger mailbox."""
+    expanded = []
+    for copy in range(copies):
+        for message in messages:
+            expanded.append(dict(message, id=f"{message['id']}-{copy}"))
+    return expanded
+
+
+async def run_scan(transport, message_params):
+    await gmail_client.set_transport(transport)
+    transport.reset_stats()
+
+    fetcher = FetchEmailSenders()
+    fetcher.message_params = message_params
+
+    start = time.perf_counter()
+    async for _ in fetcher.stream_all_messages("benchmark-token"):
+        pass
+    elapsed = time.perf_counter() - start
+
+    return {
+        "seconds": elapsed,
+        "bytes": transport.stats["bytes_sent"],
+        "requests": transport.stats["requests"],
+        "senders": len(fetcher.global_unique_emails),
+    }
+
+
+async def main(args):
+    gmail_batcher.cache = None  # Measure Gmail traffic, not local cache hits
+    messages = expand_mailbox(load_mailbox(args.fixture), args.copies)
+    transport = FakeGmailTransport(
+        messages, latency=args.latency, bandwidth=args.bandwidth
+    )
+
+    strategies = {
+        "full": {},
+        "metadata": FetchEmailSenders().message_params,
+    }
+    print(f"Mailbox: {len(messages)} messages")
+    print(
+        f"{'strategy':<10} {'seconds':>8} {'bytes':>12} {'requests':>9} {'senders':>8}"
+    )
+
+    results = {}
+    for name, params in strategies.items():
+        results[name] = await run_scan(transport, params)
+        r = results[name]
+        print(
+            f"{name:<10} {r['seconds']:>8.3f} {r['bytes']:>12,} {r['requests']:>9} {r['senders']:>8}"
+        )
+
+    full, metadata = results["full"], results["metadata"]
+    print(
+        f"metadata transfers {metadata['bytes'] / full['bytes']:.1%} of the bytes "
+        f"in {metadata['seconds'] / full['seconds']:.1%} of the time"
+    )
+    await gmail_client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixture", default=FIXTURE_PATH)
+    parser.add_argument("--copies", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--bandwidth", type=float, default=2_000_000)
+    asyncio.run(main(parser.parse_args()))
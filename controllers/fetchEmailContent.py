@@ -1,126 +1,140 @@
-import requests
+import asyncio
 import datetime
-import base64
-from typing import List, Dict
-from bs4 import BeautifulSoup  # for HTML-to-text conversion
-import re
-import unicodedata
+import os
+from typing import AsyncGenerator, Dict
 from email.utils import parsedate_to_datetime
-from utils.mailManager import mail_manager
+from utils.gmailClient import gmail_client
+from utils.gmailBatch import gmail_batcher
+from utils.htmlExtract import clean_text
+from utils.extractPool import extract_pool
+from utils.dedup import DedupIndex
+from utils.metrics import metrics
 
 GMAIL_API_URL = "https://www.googleapis.com/gmail/v1/users/me/messages"
+CONTENT_FETCH_CONCURRENCY = int(os.getenv("CONTENT_FETCH_CONCURRENCY", "25"))
+NO_TEXT_CONTENT = "No text content found"
+TEXT_MIME_TYPES = ("text/plain", "text/html")
 
 
 class EmailContentFetcher:
     def __init__(self, access_token: str, user_id):
         self.access_token = access_token
         self.userId = user_id
+        self.concurrency = CONTENT_FETCH_CONCURRENCY
+        self.email_count = 0  # Unique emails yielded by iter_unique_emails
+        self.dedup_stats = {"subject": 0, "exact": 0, "near": 0}
 
     def clean_text(self, text: str) -> str:
         """Normalize and remove unwanted invisible/whitespace characters."""
-        # Normalize Unicode characters (this can help convert compatibility characters)
-        text = unicodedata.normalize("NFKC", text)
-
-        # Define a set of unwanted characters: non-breaking space, zero-width spaces, etc.
-        unwanted_chars = "".join(
-            [
-                "\u00A0",  # non-breaking space
-                "\u200B",  # zero width space
-                "\u200C",  # zero width non-joiner
-                "\u200D",  # zero width joiner
-                "\uFEFF",  # zero width no-break space
-            ]
-        )
-
-        # Replace each unwanted character with a normal space
-        text = re.sub(f"[{re.escape(unwanted_chars)}]", " ", text)
-
-        # Collapse multiple whitespace characters into a single space and strip leading/trailing spaces
-        text = re.sub(r"\s+", " ", text).strip()
-
-        return text
-
-    def fetch_recent_emails(self, senders: Dict[str, str]) -> List[Dict[str, str]]:
-        """Fetches recent emails from specific senders within the last 7 days."""
-        try:
-            now = datetime.datetime.utcnow()
-            seven_days_ago = now - datetime.timedelta(days=1)
-            formatted_date = seven_days_ago.strftime("%Y/%m/%d")
-
-            # Extract only email addresses from dict values
-            email_list = list(senders.values())
-            from_query = " OR ".join(email_list)
-            query = f"from:({from_query}) after:{formatted_date} category:primary"
-
-            headers = {"Authorization": f"Bearer {self.access_token}"}
-            params = {
-                "q": query,
-                "format": "metadata",
-            }  # 'format=metadata' for lighter fetch
-
-            response = requests.get(GMAIL_API_URL, headers=headers, params=params)
+        return clean_text(text)
+
+    def build_query(self, senders: Dict[str, str]) -> str:
+        """Gmail search for mail from the selected senders in the last day."""
+        now = datetime.datetime.utcnow()
+        seven_days_ago = now - datetime.timedelta(days=1)
+        formatted_date = seven_days_ago.strftime("%Y/%m/%d")
+
+        # Extract only email addresses from dict values
+        email_list = list(senders.values())
+        from_query = " OR ".join(email_list)
+        return f"from:({from_query}) after:{formatted_date} category:primary"
+
+    async def list_message_ids(self, query: str) -> AsyncGenerator[str, None]:
+        """Yield every message ID matching `query`, following nextPageToken."""
+        params = {"q": query, "maxResults": 500}
+
+        while True:
+            response = await gmail_client.get(
+                GMAIL_API_URL, self.access_token, params=params, user_key=self.userId
+            )
             if response.status_code != 200:
                 print("Error fetching messages:", response.text)
-                return []
+                return
 
             data = response.json()
-            if "messages" not in data:
-                return []
-
-            # Now fetch the full content of each message ID
-            emails_data = []
-
-            for message in data["messages"]:
-                email_data = self.fetch_email_content(message["id"])
+            for message in data.get("messages", []):
+                yield message["id"]
+
+            next_page = data.get("nextPageToken")
+            if not next_page:
+                return
+            params["pageToken"] = next_page
+
+    async def iter_recent_emails(
+        self, senders: Dict[str, str]
+    ) -> AsyncGenerator[Dict[str, str], None]:
+        """Fetch recent emails from the selected senders concurrently (at most
+        `self.concurrency` in flight) and yield each one as soon as it is ready."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(message_id: str):
+            async with semaphore:
+                return await self.fetch_email_content(message_id)
+
+        tasks = []
+        try:
+            # Start fetching while later result pages are still being listed
+            async for message_id in self.list_message_ids(self.build_query(senders)):
+                tasks.append(asyncio.create_task(fetch(message_id)))
+
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    email_data = await next_done
+                except Exception as error:
+                    print(f"Error fetching email: {error}")
+                    continue
                 if email_data:
-                    emails_data.append(email_data)
-
-            unique_emails = self.remove_duplicates_by_subject(emails_data)
-
-            print("Total Emails", len(unique_emails))
-
-            mail_manager.set_user_mails(
-                userID=self.userId, mailCount=len(unique_emails)
-            )
-
-            return unique_emails
-
-        except Exception as error:
-            print(f"An error occurred: {error}")
-            return []
-
-    def remove_duplicates_by_subject(self, emails):
+                    yield email_data
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def iter_unique_emails(
+        self, senders: Dict[str, str]
+    ) -> AsyncGenerator[Dict[str, str], None]:
         """
-        Removes duplicate dictionaries from the 'emails' list
-        if they share the same 'subject'.
-
-        Returns a new list containing only the first occurrence
-        of each unique subject.
+        Stream recent emails, dropping repeats of a subject already seen and
+        any email whose body matches (exactly or nearly) an earlier one in
+        this fetch, since each one would cost its own refine call.
         """
         seen_subjects = set()
-        unique_emails = []
-
-        for entry in emails:
-            subj = entry.get("subject")
-            if subj not in seen_subjects:
-                unique_emails.append(entry)
-                seen_subjects.add(subj)
-
-        return unique_emails
-
-    def fetch_email_content(self, message_id: str) -> Dict[str, str]:
+        index = DedupIndex()
+        self.email_count = 0
+        self.dedup_stats = {"subject": 0, "exact": 0, "near": 0}
+
+        async for email_data in self.iter_recent_emails(senders):
+            subj = email_data.get("subject")
+            if subj in seen_subjects:
+                self.dedup_stats["subject"] += 1
+                continue
+
+            duplicate = index.check_and_add(email_data.get("parsed_text", ""))
+            if duplicate:
+                print(f"Skipping {duplicate} duplicate: {subj}")
+                self.dedup_stats[duplicate] += 1
+                continue
+
+            seen_subjects.add(subj)
+            self.email_count += 1
+            yield email_data
+
+        saved = sum(self.dedup_stats.values())
+        metrics.incr("dedup.llm_calls_saved", saved)
+        for reason, count in self.dedup_stats.items():
+            metrics.incr(f"dedup.{reason}", count)
+        print(f"Dedup saved {saved} LLM calls {self.dedup_stats}")
+
+    async def fetch_email_content(self, message_id: str) -> Dict[str, str]:
         """Fetch full email content using Gmail 'full' format."""
-        url = f"{GMAIL_API_URL}/{message_id}"
-        headers = {"Authorization": f"Bearer {self.access_token}"}
         params = {"format": "full"}  # Request the full message with all parts
 
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code != 200:
-            print("Error fetching email:", response.text)
+        msg = await gmail_batcher.get_message(
+            self.access_token, message_id, params=params, user_key=self.userId
+        )
+        if not msg:
+            print("Error fetching email:", message_id)
             return {}
 
-        msg = response.json()
-
         # Extract headers
         headers_list = msg["payload"]["headers"]
         sender_email = next(
@@ -143,9 +157,14 @@ class EmailContentFetcher:
             sent_time_formatted = parsed_datetime.strftime("%Y-%m-%d %H:%M:%S.%f%z")
 
         # Extract the message text (plain or HTML)
-        email_body = self.extract_email_text(msg)
+        email_body = await self.extract_email_text(msg)
         print("id", message_id, " subject", subject)
 
+        if email_body == NO_TEXT_CONTENT:
+            # Nothing for the refine step to work with; don't save an empty record
+            print("Skipping email without text content:", message_id)
+            return {}
+
         return {
             "email_address": sender_email,
             "subject": subject,
@@ -189,40 +208,79 @@ class EmailContentFetcher:
     #         "sent_time": sent_time,  # renamed from 'date_sent'
     #     }
 
-    def extract_email_text(self, msg) -> str:
+    def select_text_part(self, payload: dict):
+        """
+        Walk the MIME tree (iteratively, so nesting depth doesn't matter) and
+        pick the best text part: inline text/plain, then inline text/html,
+        then the same two when Gmail only returned a body.attachmentId.
+        Parts that carry a filename are real attachments and are ignored.
+        """
+        best_part, best_rank = None, None
+        stack = [payload]
+
+        while stack:
+            part = stack.pop()
+            children = part.get("parts")
+            if children:
+                stack.extend(reversed(children))  # Keep document order
+                continue
+
+            mime_type = part.get("mimeType", "")
+            body = part.get("body", {})
+            if mime_type not in TEXT_MIME_TYPES or part.get("filename"):
+                continue
+
+            if body.get("data"):
+                rank = TEXT_MIME_TYPES.index(mime_type)
+            elif body.get("attachmentId"):
+                rank = len(TEXT_MIME_TYPES) + TEXT_MIME_TYPES.index(mime_type)
+            else:
+                continue
+
+            if best_rank is None or rank < best_rank:
+                best_part, best_rank = part, rank
+                if rank == 0:
+                    break  # Inline text/plain can't be beaten
+
+        return best_part
+
+    @staticmethod
+    def part_charset(part: dict) -> str:
+        for header in part.get("headers", []):
+            if header.get("name", "").lower() == "content-type":
+                for param in header.get("value", "").split(";")[1:]:
+                    name, _, value = param.strip().partition("=")
+                    if name.lower() == "charset" and value:
+                        return value.strip('"')
+        return "utf-8"
+
+    async def fetch_attachment(self, message_id: str, attachment_id: str):
+        """Fetch a body Gmail only returned by attachmentId."""
+        url = f"{GMAIL_API_URL}/{message_id}/attachments/{attachment_id}"
+        response = await gmail_client.get(url, self.access_token, user_key=self.userId)
+        if response.status_code != 200:
+            print("Error fetching attachment body:", response.text)
+            return None
+        return response.json().get("data")
+
+    async def extract_email_text(self, msg) -> str:
         """Extracts plain text from Gmail API response (preferring text/plain,
         else fallback to stripping HTML)."""
 
-        payload = msg.get("payload", {})
-        # If the email has parts (multipart)
-        if "parts" in payload:
-            # Check each part for text/plain first
-            for part in payload["parts"]:
-                mime_type = part.get("mimeType", "")
-                body_data = part.get("body", {}).get("data")
-                if mime_type == "text/plain" and body_data:
-                    decoded_text = base64.urlsafe_b64decode(body_data).decode("utf-8")
-                    return self.clean_text(decoded_text)
-
-            # If text/plain wasn't found, try text/html
-            for part in payload["parts"]:
-                mime_type = part.get("mimeType", "")
-                body_data = part.get("body", {}).get("data")
-                if mime_type == "text/html" and body_data:
-                    decoded_html = base64.urlsafe_b64decode(body_data).decode("utf-8")
-                    soup = BeautifulSoup(decoded_html, "html.parser")
-                    return self.clean_text(soup.get_text())
-
-        else:
-            # Single-part emails
-            mime_type = payload.get("mimeType", "")
-            body_data = payload.get("body", {}).get("data")
-            if mime_type == "text/plain" and body_data:
-                decoded_text = base64.urlsafe_b64decode(body_data).decode("utf-8")
-                return self.clean_text(decoded_text)
-            elif mime_type == "text/html" and body_data:
-                decoded_html = base64.urlsafe_b64decode(body_data).decode("utf-8")
-                soup = BeautifulSoup(decoded_html, "html.parser")
-                return self.clean_text(soup.get_text())
-
-        return "No text content found"
+        part = self.select_text_part(msg.get("payload", {}))
+        if part is None:
+            return NO_TEXT_CONTENT
+
+        body = part.get("body", {})
+        body_data = body.get("data")
+        if not body_data:
+            # Only fetched when no inline text part exists anywhere in the tree
+            body_data = await self.fetch_attachment(msg.get("id"), body["attachmentId"])
+            if not body_data:
+                return NO_TEXT_CONTENT
+
+        # Decoding and HTML parsing are CPU-bound; keep them off the event loop
+        text = await extract_pool.extract(
+            body_data, part.get("mimeType"), self.part_charset(part)
+        )
+        return text or NO_TEXT_CONTENT
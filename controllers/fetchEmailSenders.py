@@ -1,87 +1,137 @@
-import requests
 import email.utils
 import asyncio
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Dict, List, AsyncGenerator
 import os
 from dotenv import load_dotenv
 import json
 from collections import OrderedDict
-
+from utils.gmailClient import gmail_client
+from utils.gmailBatch import gmail_batcher
 
 load_dotenv()
 GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
 GMAIL_API_URL = "https://www.googleapis.com/gmail/v1/users/me/messages"
+GMAIL_PROFILE_URL = "https://www.googleapis.com/gmail/v1/users/me/profile"
+GMAIL_HISTORY_URL = "https://www.googleapis.com/gmail/v1/users/me/history"
 
 client_id = os.getenv("GOOGLE_CLIENT_ID")
 client_secret = os.getenv("GOOGLE_CLIENT_SECRET")
 
+# The scan only reads sender headers, so ask Gmail for a metadata projection
+# instead of downloading full message bodies.
+SENDER_METADATA_HEADERS = ["From", "List-Unsubscribe", "List-Id"]
+SENDER_SCAN_PARAMS = {"format": "metadata", "metadataHeaders": SENDER_METADATA_HEADERS}
+SENDER_SCAN_WINDOW_DAYS = float(os.getenv("SENDER_SCAN_WINDOW_DAYS", "1"))
+PRIMARY_LABEL = "CATEGORY_PERSONAL"  # Gmail's label for category:primary
+
+SENDER_SCAN_WORKERS = int(os.getenv("SENDER_SCAN_WORKERS", "4"))
+SENDER_SCAN_BATCH_SIZE = int(os.getenv("SENDER_SCAN_BATCH_SIZE", "50"))
+SENDER_SCAN_QUEUE_SIZE = int(os.getenv("SENDER_SCAN_QUEUE_SIZE", "200"))
+
 
 class FetchEmailSenders:
     def __init__(self):
         self.global_senders = OrderedDict()  # ✅ Maintains order of first appearance
         self.global_unique_emails = set()  # ✅ Tracks all encountered emails
         self.sent_senders = set()  # ✅ Tracks emails already sent to frontend
+        self.sender_last_seen: Dict[str, int] = {}  # {email: internalDate in ms}
+        self.scan_failed = False  # Don't advance the cached historyId past a gap
+        self.workers = SENDER_SCAN_WORKERS
+        self.batch_size = SENDER_SCAN_BATCH_SIZE
+        self.stats = {
+            "messages": 0,
+            "batches": 0,
+            "queue_samples": 0,
+            "queue_total": 0,
+            "queue_max": 0,
+        }
         self.SENTINEL = object()
+        self.message_params = SENDER_SCAN_PARAMS
+        self.mailbox = None  # Gmail address; keys the message cache and limits
+        # History records aren't bounded by the search query's after:, so an
+        # incremental scan skips messages received before this (ms)
+        self.min_received_ms = 0
 
         # self.global_senders: Dict[str, str] = {}
         # self.global_unique_emails = set()
 
+    def record_sender(self, msg_data: dict):
+        """Store the sender of a fetched message if it has not been seen yet
+        and the message is inside the scan window."""
+        payload = msg_data.get("payload", {})
+        msg_headers = payload.get("headers", [])
+        received_at = int(msg_data.get("internalDate") or 0)
+        if received_at and received_at < self.min_received_ms:
+            return
+
+        for header in msg_headers:
+            if isinstance(header, dict) and header.get("name", "").lower() == "from":
+                sender_name, sender_email = email.utils.parseaddr(
+                    header.get("value", "")
+                )
+                if not sender_email:
+                    continue
+                self.sender_last_seen[sender_email] = max(
+                    received_at, self.sender_last_seen.get(sender_email, 0)
+                )
+                if sender_email in self.global_unique_emails:
+                    continue
+                if not sender_name:
+                    sender_name = sender_email
+
+                # Ensure we keep the first occurrence and ignore duplicates
+                self.global_senders[sender_name] = sender_email
+                self.global_unique_emails.add(sender_email)  # Track seen emails
+
+    async def fetch_message(self, access_token: str, msg_id: str):
+        """Fetch a single message through the shared batcher, returning None
+        when Gmail refuses it."""
+        return await gmail_batcher.get_message(
+            access_token, msg_id, params=self.message_params, user_key=self.mailbox
+        )
+
     async def process_messages(self, access_token: str, message_ids: List[str]):
-        """Process a batch of messages and store sender data."""
-        headers = {"Authorization": f"Bearer {access_token}"}
-
-        for msg_id in message_ids:
-            msg_url = f"{GMAIL_API_URL}/{msg_id}"
-            msg_response = requests.get(msg_url, headers=headers)
-            if msg_response.status_code != 200:
-                continue  # Skip failed requests
-
-            msg_data = msg_response.json()
-            payload = msg_data.get("payload", {})
-            msg_headers = payload.get("headers", [])
-
-            for header in msg_headers:
-                if (
-                    isinstance(header, dict)
-                    and header.get("name", "").lower() == "from"
-                ):
-                    sender_name, sender_email = email.utils.parseaddr(
-                        header.get("value", "")
-                    )
-                    if not sender_email or sender_email in self.global_unique_emails:
-                        continue
-                    if not sender_name:
-                        sender_name = sender_email
-
-                    # Ensure unique sender names
-                    # Ensure we keep the first occurrence and ignore duplicates
-                    if sender_email not in self.global_unique_emails:
-                        self.global_senders[sender_name] = (
-                            sender_email  # First occurrence is stored
-                        )
-                        self.global_unique_emails.add(sender_email)  # Track seen emails
+        """Fetch a batch of messages (packed into Gmail batch requests) and
+        store sender data. A message that can't be fetched marks the scan as
+        failed so its sender is picked up by the next scan."""
+        results = await asyncio.gather(
+            *(self.fetch_message(access_token, msg_id) for msg_id in message_ids),
+            return_exceptions=True,
+        )
 
-    async def fetch_message_ids(
+        for msg_id, msg_data in zip(message_ids, results):
+            if isinstance(msg_data, Exception):
+                print("Error fetching message:", msg_data)
+                self.scan_failed = True
+                continue
+            if msg_data:
+                self.record_sender(msg_data)
+            else:
+                print("No data for message:", msg_id)
+                self.scan_failed = True
+
+    async def queue_search_results(
         self, access_token: str, query: str, message_queue: asyncio.Queue
     ):
-        """Fetch message IDs and add them to the queue."""
-        headers = {"Authorization": f"Bearer {access_token}"}
+        """Page through a messages.list search and queue every message ID."""
         params = {"q": query}
 
         while True:
-            response = requests.get(GMAIL_API_URL, headers=headers, params=params)
+            response = await gmail_client.get(
+                GMAIL_API_URL, access_token, params=params
+            )
             if response.status_code != 200:
                 print("Error fetching messages:", response.text)
+                self.scan_failed = True
                 return
 
             data = response.json()
-            print("Data")  # ✅ Prints fetched messages
 
             if "messages" in data:
-                message_ids = [msg["id"] for msg in data["messages"]]
-                for msg_id in message_ids:
-                    await message_queue.put(msg_id)  # ✅ Store message IDs in the queue
+                for msg in data["messages"]:
+                    await message_queue.put(msg["id"])  # Store IDs in the queue
             else:
                 break  # No more messages
 
@@ -91,43 +141,224 @@ class FetchEmailSenders:
             else:
                 break
 
+    async def fetch_message_ids(
+        self, access_token: str, query: str, message_queue: asyncio.Queue
+    ):
+        """Fetch message IDs and add them to the queue."""
+        try:
+            await self.queue_search_results(access_token, query, message_queue)
+        finally:
+            # Tell the consumer no more IDs are coming, even on failure
+            await message_queue.put(self.SENTINEL)
+
+    async def fetch_history_message_ids(
+        self,
+        access_token: str,
+        start_history_id: str,
+        query: str,
+        message_queue: asyncio.Queue,
+    ):
+        """Queue only the primary-inbox messages added since `start_history_id`.
+        Falls back to a full search when Gmail no longer has that history."""
+        params = {
+            "startHistoryId": start_history_id,
+            "historyTypes": "messageAdded",
+            "labelId": PRIMARY_LABEL,
+        }
+        queued = set()
+
+        try:
+            while True:
+                response = await gmail_client.get(
+                    GMAIL_HISTORY_URL, access_token, params=params
+                )
+                if response.status_code == 404:
+                    print("History expired, falling back to a full scan")
+                    await self.queue_search_results(access_token, query, message_queue)
+                    return
+                if response.status_code != 200:
+                    print("Error fetching history:", response.text)
+                    self.scan_failed = True
+                    return
+
+                data = response.json()
+                for record in data.get("history", []):
+                    for added in record.get("messagesAdded", []):
+                        msg_id = added.get("message", {}).get("id")
+                        if msg_id and msg_id not in queued:
+                            queued.add(msg_id)
+                            await message_queue.put(msg_id)
+
+                next_page = data.get("nextPageToken")
+                if next_page:
+                    params["pageToken"] = next_page
+                else:
+                    break
+        finally:
+            await message_queue.put(self.SENTINEL)
+
+    async def fetch_profile(self, access_token: str):
+        """Return the mailbox address and current historyId, or None."""
+        try:
+            response = await gmail_client.get(GMAIL_PROFILE_URL, access_token)
+        except Exception as e:
+            print("Error fetching Gmail profile:", e)
+            return None
+        if response.status_code != 200:
+            print("Error fetching Gmail profile:", response.text)
+            return None
+        return response.json()
+
+    def restore_senders(self, cache: dict, window_start_ms: int) -> OrderedDict:
+        """Load cached senders still inside the scan window and mark them as
+        already sent. Returns the restored senders for the first SSE event."""
+        restored = OrderedDict()
+        for sender in cache.get("senders") or []:
+            sender_email = sender.get("email")
+            last_seen = int(sender.get("last_seen") or 0)
+            if not sender_email or last_seen < window_start_ms:
+                continue
+            if sender_email in self.global_unique_emails:
+                continue
+            sender_name = sender.get("name") or sender_email
+            self.global_senders[sender_name] = sender_email
+            self.global_unique_emails.add(sender_email)
+            self.sent_senders.add(sender_email)
+            self.sender_last_seen[sender_email] = last_seen
+            restored[sender_name] = sender_email
+        return restored
+
+    async def load_sender_cache(self, mailbox: str):
+        from utils.supabaseUtils import supabase_func_instance
+
+        if supabase_func_instance is None:
+            return None
+        return await supabase_func_instance.get_sender_cache(mailbox)
+
+    async def save_sender_cache(self, mailbox: str, history_id: str):
+        from utils.supabaseUtils import supabase_func_instance
+
+        if supabase_func_instance is None:
+            return None
+        senders = [
+            {
+                "name": sender_name,
+                "email": sender_email,
+                "last_seen": self.sender_last_seen.get(sender_email, 0),
+            }
+            for sender_name, sender_email in self.global_senders.items()
+        ]
+        data = {"mailbox": mailbox, "history_id": str(history_id), "senders": senders}
+        return await supabase_func_instance.upsert_into_table(
+            "sender_scan_cache", data, "mailbox"
+        )
+
+    async def next_batch(self, message_queue: asyncio.Queue):
+        """Wait for at least one ID, then drain up to `batch_size` IDs that are
+        already queued. Returns (batch, end_of_input)."""
+        batch = [await message_queue.get()]
+
+        depth = message_queue.qsize()
+        self.stats["queue_samples"] += 1
+        self.stats["queue_total"] += depth
+        self.stats["queue_max"] = max(self.stats["queue_max"], depth + 1)
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(message_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        if self.SENTINEL in batch:
+            # Put the end-of-input marker back so the other workers see it too
+            await message_queue.put(self.SENTINEL)
+            return [msg_id for msg_id in batch if msg_id is not self.SENTINEL], True
+        return batch, False
+
+    async def publish_new_senders(self, stream_queue: asyncio.Queue):
+        """Send senders discovered since the last update to the stream."""
+        current_batch_senders = OrderedDict()
+        for sender_name, sender_email in self.global_senders.items():
+            if sender_email not in self.sent_senders:
+                current_batch_senders[sender_name] = sender_email
+                self.sent_senders.add(sender_email)
+
+        if current_batch_senders:
+            await stream_queue.put(json.dumps({"senders": current_batch_senders}))
+
     async def process_batches(
         self,
         access_token: str,
         message_queue: asyncio.Queue,
         stream_queue: asyncio.Queue,
     ):
-        """Process messages in batches of 10 and send updates."""
-
-        while True:
-            batch_size = min(1, message_queue.qsize())  #  Get batch size dynamically
-            if batch_size == 0:
-                break  #  Stop when queue is empty
+        """Drain the message queue with `self.workers` concurrent consumers,
+        sending an update after each batch. The queue is bounded, so a slow
+        consumer side throttles the producer."""
+        remaining = self.workers
 
-            batch = await asyncio.gather(
-                *(message_queue.get() for _ in range(batch_size))
-            )
-            await self.process_messages(access_token, batch)
+        async def worker():
+            nonlocal remaining
+            try:
+                done = False
+                while not done:
+                    batch, done = await self.next_batch(message_queue)
+                    if batch:
+                        await self.process_messages(access_token, batch)
+                        self.stats["messages"] += len(batch)
+                        self.stats["batches"] += 1
+                    await self.publish_new_senders(stream_queue)
+            finally:
+                remaining -= 1
+                if remaining == 0:
+                    # ✅ Signal completion by placing sentinel in stream_queue
+                    await stream_queue.put(self.SENTINEL)
 
-            # Extract senders from global_senders (current known senders)
-            current_batch_senders = OrderedDict()
-            for sender_name, sender_email in self.global_senders.items():
-                if sender_email not in self.sent_senders:
-                    current_batch_senders[sender_name] = sender_email
-                    self.sent_senders.add(sender_email)
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
 
-            if current_batch_senders:
-                await stream_queue.put(json.dumps({"senders": current_batch_senders}))
-        # ✅ Signal completion by placing sentinel in stream_queue
-        await stream_queue.put(self.SENTINEL)
+    def throughput_report(self, elapsed: float) -> dict:
+        samples = self.stats["queue_samples"]
+        return {
+            "messages": self.stats["messages"],
+            "batches": self.stats["batches"],
+            "workers": self.workers,
+            "seconds": round(elapsed, 3),
+            "messages_per_sec": round(self.stats["messages"] / elapsed, 2)
+            if elapsed > 0
+            else 0.0,
+            "avg_queue_depth": round(self.stats["queue_total"] / samples, 2)
+            if samples
+            else 0.0,
+            "max_queue_depth": self.stats["queue_max"],
+        }
 
     async def stream_all_messages(self, access_token: str) -> AsyncGenerator[str, None]:
         now = datetime.now(timezone.utc)
-        last_7_days = now - timedelta(days=1)
-        query = f"after:{int(last_7_days.timestamp())} category:primary"
+        window_start = now - timedelta(days=SENDER_SCAN_WINDOW_DAYS)
+        query = f"after:{int(window_start.timestamp())} category:primary"
+        window_start_ms = int(window_start.timestamp() * 1000)
 
-        message_queue = asyncio.Queue(maxsize=100)
+        message_queue = asyncio.Queue(maxsize=SENDER_SCAN_QUEUE_SIZE)
         stream_queue = asyncio.Queue()
+        started_at = time.perf_counter()
+
+        # Capture the historyId before scanning so nothing that arrives during
+        # the scan is missed by the next incremental run.
+        profile = await self.fetch_profile(access_token)
+        mailbox = profile.get("emailAddress") if profile else None
+        self.mailbox = mailbox
+        cache = await self.load_sender_cache(mailbox) if mailbox else None
+
+        if cache and cache.get("history_id"):
+            cached_senders = self.restore_senders(cache, window_start_ms)
+            if cached_senders:
+                yield f"data: {json.dumps({'senders': cached_senders})}\n\n"
+            self.min_received_ms = window_start_ms
+            producer = self.fetch_history_message_ids(
+                access_token, cache["history_id"], query, message_queue
+            )
+        else:
+            producer = self.fetch_message_ids(access_token, query, message_queue)
 
         async def send_stream_updates():
             """Continuously yield new updates as they arrive in stream_queue."""
@@ -137,9 +368,7 @@ class FetchEmailSenders:
                     break
                 yield f"data: {update}\n\n"
 
-        fetch_task = asyncio.create_task(
-            self.fetch_message_ids(access_token, query, message_queue)
-        )
+        fetch_task = asyncio.create_task(producer)
         process_task = asyncio.create_task(
             self.process_batches(access_token, message_queue, stream_queue)
         )
@@ -149,5 +378,11 @@ class FetchEmailSenders:
 
         await asyncio.gather(fetch_task, process_task)
 
-        print("DOONEE")
+        if mailbox and profile.get("historyId") and not self.scan_failed:
+            await self.save_sender_cache(mailbox, profile["historyId"])
+
+        report = self.throughput_report(time.perf_counter() - started_at)
+        print("Sender scan finished", report)
+        # Named event so clients that only handle sender messages ignore it
+        yield f"event: stats\ndata: {json.dumps(report)}\n\n"
         yield "data: [DONE]\n\n"
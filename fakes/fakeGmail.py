@@ -0,0 +1,254 @@
+import asyncio
+import json
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+import httpx
+
+from utils.gmailBatch import get_boundary, split_multipart
+
+MESSAGES_PATH = "/gmail/v1/users/me/messages"
+PROFILE_PATH = "/gmail/v1/users/me/profile"
+HISTORY_PATH = "/gmail/v1/users/me/history"
+BATCH_PATH = "/batch/gmail/v1"
+
+
+def load_mailbox(path: str) -> List[dict]:
+    """Load a recorded mailbox fixture (a JSON list of Gmail 'full' messages)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakeGmailTransport(httpx.AsyncBaseTransport):
+    """
+    Offline stand-in for the Gmail REST API, mounted as an httpx transport.
+
+    Serves messages.list, messages.get (full/metadata/minimal formats),
+    messages.attachments.get, getProfile, history.list (messageAdded records
+    derived from each message's historyId) and the multipart batch endpoint
+    from an in-memory mailbox, and keeps request and byte counters so callers
+    can compare fetch strategies. `latency` is added per HTTP request and
+    `bandwidth` (bytes/sec) makes larger responses slower. With
+    `batch_part_limit`, batch parts past that many answer 429.
+    """
+
+    def __init__(
+        self,
+        messages: List[dict],
+        page_size: int = 100,
+        latency: float = 0.0,
+        bandwidth: Optional[float] = None,
+        attachments: Optional[dict] = None,
+        batch_part_limit: Optional[int] = None,
+    ):
+        self.messages = OrderedDict((m["id"], m) for m in messages)
+        self.attachments = attachments or {}  # {(message_id, attachment_id): data}
+        self.page_size = page_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.email_address = "reader@example.com"
+        self.history_floor = 0  # startHistoryIds below this answer 404
+        # Parts past this many in one batch answer 429, as Gmail's do
+        self.batch_part_limit = batch_part_limit
+        self.stats = {
+            "requests": 0,
+            "batch_requests": 0,
+            "bytes_sent": 0,
+            "rate_limited_parts": 0,
+        }
+
+    def reset_stats(self):
+        for key in self.stats:
+            self.stats[key] = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.stats["requests"] += 1
+
+        if request.method == "POST" and request.url.path.endswith(BATCH_PATH):
+            body = await request.aread()
+            status_code = 200
+            content_type, content = self.handle_batch(
+                request.headers.get("content-type", ""), body
+            )
+        else:
+            status_code, data = self.route(request.url.path, request.url.params)
+            content_type = "application/json; charset=UTF-8"
+            content = json.dumps(data).encode("utf-8")
+
+        self.stats["bytes_sent"] += len(content)
+        if self.bandwidth:
+            await asyncio.sleep(len(content) / self.bandwidth)
+        return httpx.Response(
+            status_code, headers={"content-type": content_type}, content=content
+        )
+
+    def handle_batch(self, content_type: str, body: bytes):
+        self.stats["batch_requests"] += 1
+        boundary = get_boundary(content_type)
+        response_boundary = f"batch_{uuid.uuid4().hex}"
+        lines = []
+
+        parts = split_multipart(body, boundary or "")
+        for index, (headers, content) in enumerate(parts):
+            content_id = headers.get("content-id", "").strip("<>")
+            request_line = content.replace(b"\r\n", b"\n").split(b"\n", 1)[0]
+            _, target = request_line.decode("utf-8").split(" ", 1)
+            url = httpx.URL(target.split(" ")[0])
+            if self.batch_part_limit is not None and index >= self.batch_part_limit:
+                self.stats["rate_limited_parts"] += 1
+                status_code, data = 429, self.rate_limit_error()
+            else:
+                status_code, data = self.route(url.path, url.params)
+            lines.extend(
+                [
+                    f"--{response_boundary}",
+                    "Content-Type: application/http",
+                    f"Content-ID: <response-{content_id}>",
+                    "",
+                    f"HTTP/1.1 {status_code} {'OK' if status_code == 200 else 'Error'}",
+                    "Content-Type: application/json; charset=UTF-8",
+                    "",
+                    json.dumps(data),
+                    "",
+                ]
+            )
+        lines.append(f"--{response_boundary}--")
+        return (
+            f"multipart/mixed; boundary={response_boundary}",
+            "\r\n".join(lines).encode("utf-8"),
+        )
+
+    def rate_limit_error(self) -> dict:
+        return {
+            "error": {
+                "code": 429,
+                "message": "Too many concurrent requests for user",
+                "errors": [{"reason": "rateLimitExceeded", "domain": "usageLimits"}],
+            }
+        }
+
+    def add_message(self, message: dict):
+        """Deliver a new message, giving it the next historyId."""
+        message = dict(message, historyId=str(self.latest_history_id() + 1))
+        self.messages[message["id"]] = message
+
+    def latest_history_id(self) -> int:
+        return max(
+            (int(m.get("historyId", 0)) for m in self.messages.values()), default=0
+        )
+
+    def route(self, path: str, params: httpx.QueryParams):
+        if path.endswith(PROFILE_PATH):
+            return 200, {
+                "emailAddress": self.email_address,
+                "messagesTotal": len(self.messages),
+                "historyId": str(self.latest_history_id()),
+            }
+
+        if path.endswith(HISTORY_PATH):
+            return self.list_history(params)
+
+        if path.endswith(MESSAGES_PATH):
+            return 200, self.list_messages(params)
+
+        if "/attachments/" in path:
+            msg_id, _, attachment_id = path.split(f"{MESSAGES_PATH}/", 1)[1].split("/")
+            data = self.attachments.get((msg_id, attachment_id))
+            if data is None:
+                return 404, {"error": {"code": 404, "message": "Not Found"}}
+            return 200, {"size": len(data), "data": data}
+
+        if f"{MESSAGES_PATH}/" in path:
+            msg_id = path.rsplit("/", 1)[1]
+            message = self.messages.get(msg_id)
+            if message is None:
+                return 404, {"error": {"code": 404, "message": "Not Found"}}
+            return 200, self.project(
+                message,
+                params.get("format", "full"),
+                params.get_list("metadataHeaders"),
+            )
+
+        return 404, {"error": {"code": 404, "message": f"No fake route for {path}"}}
+
+    def list_messages(self, params: httpx.QueryParams) -> dict:
+        ids = list(self.messages.keys())
+        page_size = min(int(params.get("maxResults", self.page_size)), self.page_size)
+        offset = int(params.get("pageToken", 0))
+        page = ids[offset : offset + page_size]
+
+        data = {
+            "messages": [
+                {
+                    "id": msg_id,
+                    "threadId": self.messages[msg_id].get("threadId", msg_id),
+                }
+                for msg_id in page
+            ],
+            "resultSizeEstimate": len(ids),
+        }
+        if offset + page_size < len(ids):
+            data["nextPageToken"] = str(offset + page_size)
+        if not page:
+            data.pop("messages")
+        return data
+
+    def list_history(self, params: httpx.QueryParams):
+        start = int(params.get("startHistoryId", 0))
+        if start < self.history_floor:
+            return 404, {
+                "error": {"code": 404, "message": "Requested entity was not found."}
+            }
+
+        label = params.get("labelId")
+        history = [
+            {
+                "id": message["historyId"],
+                "messagesAdded": [
+                    {
+                        "message": {
+                            "id": message["id"],
+                            "labelIds": message.get("labelIds", []),
+                        }
+                    }
+                ],
+            }
+            for message in self.messages.values()
+            if int(message.get("historyId", 0)) > start
+            and (not label or label in message.get("labelIds", []))
+        ]
+        return 200, {"history": history, "historyId": str(self.latest_history_id())}
+
+    @staticmethod
+    def project(message: dict, fmt: str, metadata_headers: Optional[List[str]]) -> dict:
+        base = {
+            key: message[key]
+            for key in (
+                "id",
+                "threadId",
+                "labelIds",
+                "snippet",
+                "historyId",
+                "internalDate",
+                "sizeEstimate",
+            )
+            if key in message
+        }
+        if fmt == "minimal":
+            return base
+        if fmt == "metadata":
+            wanted = {h.lower() for h in metadata_headers or []}
+            headers = [
+                h
+                for h in message.get("payload", {}).get("headers", [])
+                if not wanted or h.get("name", "").lower() in wanted
+            ]
+            base["payload"] = {
+                "mimeType": message.get("payload", {}).get("mimeType"),
+                "headers": headers,
+            }
+            return base
+        return message
@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import json
+import math
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Optional
+
+import httpx
+
+CHAT_COMPLETIONS_PATH = "/chat/completions"
+CHARS_PER_TOKEN = 4
+STREAM_CHUNK_TOKENS = 4  # Content per streamed event
+# OpenAI caches prompt prefixes from 1024 tokens on, in 128-token steps
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def default_reply(body: dict) -> str:
+    """Echo the tail of the prompt; JSON mode gets a minimal episode object."""
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        return json.dumps(
+            {
+                "EpisodeName": "Fake Episode",
+                "Topic": {"Subtopic": ["Fake summary of the newsletters."]},
+            }
+        )
+    content = body["messages"][-1].get("content") or ""
+    return content[-400:]
+
+
+class FakeOpenAITransport(httpx.AsyncBaseTransport):
+    """
+    Offline stand-in for the OpenAI chat completions API, mounted as an
+    httpx transport (see LLMScheduler.set_transport).
+
+    Enforces requests-per-minute and tokens-per-minute limits per model over
+    a sliding minute and answers over-limit calls with 429 and the
+    retry-after / retry-after-ms headers the real API sends. Each call takes
+    `latency` seconds plus `seconds_per_token` per completion token, and
+    `stream=True` calls receive the text as server-sent chunks at that pace.
+    `reply(body)` produces the completion text.
+
+    Prompt caching works like the real API's: a prompt prefix of 1024 tokens
+    or more that an earlier call sent is reported as
+    usage.prompt_tokens_details.cached_tokens, in 128-token steps. Only the
+    uncached prompt tokens cost `seconds_per_prompt_token` each before the
+    first output token.
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        latency: float = 0.0,
+        seconds_per_token: float = 0.0,
+        reply: Callable[[dict], str] = default_reply,
+        seconds_per_prompt_token: float = 0.0,
+    ):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.latency = latency
+        self.seconds_per_token = seconds_per_token
+        self.reply = reply
+        self.seconds_per_prompt_token = seconds_per_prompt_token
+        self.prefix_cache = set()  # Digests of cached prompt prefixes
+        self.window: Dict[str, deque] = defaultdict(deque)  # {model: (time, tokens)}
+        self.in_flight = 0
+        self.stats = {
+            "requests": 0,
+            "completed": 0,
+            "rate_limited": 0,
+            "max_in_flight": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "completion_tokens": 0,
+        }
+        self.completed_by_model = defaultdict(list)  # {model: [finish times]}
+
+    def reset_stats(self):
+        for key in self.stats:
+            self.stats[key] = 0
+        self.completed_by_model.clear()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not (
+            request.method == "POST"
+            and request.url.path.endswith(CHAT_COMPLETIONS_PATH)
+        ):
+            return self.error(404, "not_found", f"No fake route for {request.url.path}")
+
+        self.stats["requests"] += 1
+        body = json.loads(await request.aread())
+        model = body["model"]
+        prompt_tokens = sum(
+            estimate_tokens(m.get("content") or "") + 4 for m in body["messages"]
+        )
+        reserved = prompt_tokens + (body.get("max_tokens") or 0)
+
+        wait = self.over_limit(model, reserved)
+        if wait is not None:
+            self.stats["rate_limited"] += 1
+            return self.error(
+                429,
+                "rate_limit_exceeded",
+                f"Rate limit reached for {model}. Please try again in {wait:.3f}s.",
+                headers={
+                    "retry-after": str(math.ceil(wait)),
+                    "retry-after-ms": str(int(wait * 1000)),
+                },
+            )
+        self.window[model].append((time.monotonic(), reserved))
+
+        content = self.reply(body)
+        completion_tokens = estimate_tokens(content)
+        cached_tokens = min(prompt_tokens, self.cache_prompt(model, body["messages"]))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        prefill = (prompt_tokens - cached_tokens) * self.seconds_per_prompt_token
+        if body.get("stream"):
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=self.stream(body, content, usage, prefill),
+            )
+
+        async with self.generating(model, usage):
+            await asyncio.sleep(
+                self.latency + prefill + completion_tokens * self.seconds_per_token
+            )
+        data = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage,
+        }
+        return httpx.Response(200, json=data)
+
+    @asynccontextmanager
+    async def generating(self, model: str, usage: dict):
+        self.in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+        self.stats["completed"] += 1
+        self.stats["prompt_tokens"] += usage["prompt_tokens"]
+        self.stats["cached_tokens"] += usage["prompt_tokens_details"]["cached_tokens"]
+        self.stats["completion_tokens"] += usage["completion_tokens"]
+        self.completed_by_model[model].append(time.monotonic())
+
+    async def stream(
+        self, body: dict, content: str, usage: dict, prefill: float
+    ) -> AsyncIterator[bytes]:
+        """Server-sent chat.completion.chunk events, STREAM_CHUNK_TOKENS at a
+        time, after `latency` plus `prefill` for the first one."""
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        size = STREAM_CHUNK_TOKENS * CHARS_PER_TOKEN
+
+        def event(choices, **extra) -> bytes:
+            data = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": choices,
+                **extra,
+            }
+            return f"data: {json.dumps(data)}\n\n".encode("utf-8")
+
+        async with self.generating(body["model"], usage):
+            await asyncio.sleep(self.latency + prefill)
+            for i in range(0, len(content), size):
+                piece = content[i : i + size]
+                await asyncio.sleep(estimate_tokens(piece) * self.seconds_per_token)
+                delta = {"content": piece}
+                if i == 0:
+                    delta["role"] = "assistant"
+                yield event([{"index": 0, "delta": delta, "finish_reason": None}])
+            yield event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield event([], usage=usage)
+            yield b"data: [DONE]\n\n"
+
+    def cache_prompt(self, model: str, messages: list) -> int:
+        """Tokens of the longest cached prefix of this prompt; caches its own."""
+        text = "".join(f"{m['role']}\n{m.get('content') or ''}\n" for m in messages)
+        block = CACHE_BLOCK_TOKENS * CHARS_PER_TOKEN
+        minimum = CACHE_MIN_TOKENS * CHARS_PER_TOKEN
+
+        digest = hashlib.sha256(model.encode("utf-8"))
+        cached_chars = 0
+        for end in range(block, len(text) + 1, block):
+            digest.update(text[end - block : end].encode("utf-8"))
+            if end < minimum:
+                continue
+            # Each digest covers the whole prefix, so a hit means all of it matched
+            key = digest.hexdigest()
+            if key in self.prefix_cache:
+                cached_chars = end
+            self.prefix_cache.add(key)
+        return cached_chars // CHARS_PER_TOKEN
+
+    def over_limit(self, model: str, tokens: int) -> Optional[float]:
+        """Seconds until a call of `tokens` fits both limits, or None if it fits."""
+        window = self.window[model]
+        now = time.monotonic()
+        while window and now - window[0][0] >= 60:
+            window.popleft()
+
+        waits = []
+        if self.rpm is not None and len(window) >= self.rpm:
+            waits.append(60 - (now - window[len(window) - self.rpm][0]))
+        if self.tpm is not None:
+            used = sum(t for _, t in window)
+            if used + tokens > self.tpm:
+                # Wait until enough of the oldest calls leave the window
+                for started, t in window:
+                    used -= t
+                    if used + tokens <= self.tpm:
+                        waits.append(60 - (now - started))
+                        break
+                else:
+                    waits.append(60.0)
+        return max(waits) if waits else None
+
+    def error(self, status: int, code: str, message: str, headers=None):
+        return httpx.Response(
+            status,
+            headers=headers,
+            json={
+                "error": {
+                    "message": message,
+                    "type": "requests" if status == 429 else "invalid_request_error",
+                    "param": None,
+                    "code": code,
+                }
+            },
+        )
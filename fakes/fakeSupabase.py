@@ -0,0 +1,408 @@
+import asyncio
+import base64
+import copy
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+
+load_dotenv()
+
+FAKE_SUPABASE_LATENCY = float(os.getenv("FAKE_SUPABASE_LATENCY", "0"))  # Seconds
+FAKE_SUPABASE_ERROR_RATE = float(os.getenv("FAKE_SUPABASE_ERROR_RATE", "0"))
+# Where the database webhooks are delivered; empty disables them
+FAKE_SUPABASE_WEBHOOK_URL = os.getenv("FAKE_SUPABASE_WEBHOOK_URL", "")
+
+NEWSLETTER_TABLE = "user_news_letters"
+
+COMPARISONS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+}
+
+
+class FakeResponse:
+    def __init__(self, data, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def column_names(columns: str) -> Optional[List[str]]:
+    names = [name.strip() for name in columns.split(",")]
+    return None if "*" in names else names
+
+
+def split_terms(expression: str) -> List[str]:
+    """Split a PostgREST logic expression on its top-level commas."""
+    terms, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(expression):
+        if char == '"':
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            terms.append(expression[start:i])
+            start = i + 1
+    terms.append(expression[start:])
+    return [term.strip() for term in terms if term.strip()]
+
+
+def parse_condition(term: str):
+    """Build a row predicate from one `or_` term, e.g. `id.lt."5"` or `and(...)`."""
+    for combine, name in ((all, "and"), (any, "or")):
+        if term.startswith(f"{name}(") and term.endswith(")"):
+            checks = [parse_condition(t) for t in split_terms(term[len(name) + 1 : -1])]
+            return lambda row: combine(check(row) for check in checks)
+
+    column, op, value = term.split(".", 2)
+    if value.startswith('"') and value.endswith('"'):
+        value = value[1:-1]
+    compare = COMPARISONS[op]
+
+    def check(row: dict) -> bool:
+        current = row.get(column)
+        if current is None:
+            return False
+        # Filter values arrive as text; compare them as the column's type
+        if isinstance(current, (int, float)) and not isinstance(current, bool):
+            return compare(current, type(current)(value))
+        return compare(str(current), value)
+
+    return check
+
+
+class FakeQuery:
+    """
+    The subset of the PostgREST request builder this backend uses. Filters
+    and modifiers accumulate until `execute`, which applies the operation to
+    the in-memory table.
+    """
+
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.client = client
+        self.table = table
+        self.operation = "select"
+        self.payload = None
+        self.columns = None
+        self.on_conflict: List[str] = []
+        self.filters = []
+        self.orders = []
+        self.row_limit = None
+        self.single_row = False
+
+    def select(self, columns: str = "*", count=None):
+        self.operation = "select"
+        self.columns = column_names(columns)
+        return self
+
+    def insert(self, data):
+        self.operation, self.payload = "insert", data
+        return self
+
+    def update(self, data: dict):
+        self.operation, self.payload = "update", data
+        return self
+
+    def upsert(self, data, on_conflict=None):
+        self.operation, self.payload = "upsert", data
+        if isinstance(on_conflict, str):
+            on_conflict = on_conflict.split(",")
+        self.on_conflict = [name.strip() for name in on_conflict or ["id"]]
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def in_(self, column: str, values):
+        allowed = {str(value) for value in values}
+        self.filters.append(lambda row: str(row.get(column)) in allowed)
+        return self
+
+    def lt(self, column: str, value):
+        self.filters.append(
+            lambda row: row.get(column) is not None and row[column] < value
+        )
+        return self
+
+    def gt(self, column: str, value):
+        self.filters.append(
+            lambda row: row.get(column) is not None and row[column] > value
+        )
+        return self
+
+    def or_(self, filters: str):
+        self.filters.append(parse_condition(f"or({filters})"))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, size: int):
+        self.row_limit = size
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    def matches(self, row: dict) -> bool:
+        return all(check(row) for check in self.filters)
+
+    def project(self, row: dict) -> dict:
+        if self.columns is None:
+            return copy.deepcopy(row)
+        return {name: copy.deepcopy(row.get(name)) for name in self.columns}
+
+    async def execute(self) -> FakeResponse:
+        await self.client.before_request()
+        rows = self.client.tables.setdefault(self.table, [])
+        handler = getattr(self, f"run_{self.operation}")
+        data = handler(rows)
+
+        if self.single_row:
+            if len(data) != 1:
+                raise APIError(
+                    {
+                        "code": "PGRST116",
+                        "message": "JSON object requested, multiple (or no) rows returned",
+                    }
+                )
+            data = data[0]
+        return FakeResponse(data)
+
+    def run_select(self, rows: List[dict]) -> List[dict]:
+        selected = [row for row in rows if self.matches(row)]
+        for column, desc in reversed(self.orders):
+            # Postgres puts NULLs last ascending and first descending
+            selected.sort(
+                key=lambda row: (row.get(column) is None, row.get(column)),
+                reverse=desc,
+            )
+        if self.row_limit is not None:
+            selected = selected[: self.row_limit]
+        return [self.project(row) for row in selected]
+
+    def run_insert(self, rows: List[dict]) -> List[dict]:
+        records = self.payload if isinstance(self.payload, list) else [self.payload]
+        inserted = [self.client.insert_row(self.table, record) for record in records]
+        return copy.deepcopy(inserted)
+
+    def run_update(self, rows: List[dict]) -> List[dict]:
+        updated = []
+        for row in rows:
+            if self.matches(row):
+                self.client.update_row(self.table, row, self.payload)
+                updated.append(copy.deepcopy(row))
+        return updated
+
+    def run_upsert(self, rows: List[dict]) -> List[dict]:
+        records = self.payload if isinstance(self.payload, list) else [self.payload]
+        result = []
+        for record in records:
+            key = [str(record.get(column)) for column in self.on_conflict]
+            existing = next(
+                (
+                    row
+                    for row in rows
+                    if [str(row.get(column)) for column in self.on_conflict] == key
+                ),
+                None,
+            )
+            if existing is None:
+                result.append(self.client.insert_row(self.table, record))
+            else:
+                self.client.update_row(self.table, existing, record)
+                result.append(existing)
+        return copy.deepcopy(result)
+
+    def run_delete(self, rows: List[dict]) -> List[dict]:
+        deleted = [row for row in rows if self.matches(row)]
+        rows[:] = [row for row in rows if not self.matches(row)]
+        return deleted
+
+
+class FakeAuth:
+    """`auth.get_user` for tokens issued by `FakeSupabase.issue_token`."""
+
+    def __init__(self, client: "FakeSupabase"):
+        self.client = client
+
+    async def get_user(self, token: str):
+        await self.client.before_request(inject_errors=False)
+        user_id = self.client.tokens.get(token)
+        if user_id is None:
+            raise Exception("invalid JWT: unable to parse or verify signature")
+        return SimpleNamespace(user=SimpleNamespace(id=user_id))
+
+
+class FakeSupabase:
+    """
+    In-memory stand-in for the Supabase async client: `table()`/`schema()`
+    queries, `auth.get_user`, and the database webhooks our project
+    configures. New `user_news_letters` rows are posted to /ai/refineText,
+    and setting a row's refined_text posts the user's unprocessed rows to
+    /ai/episodeLimitCheck.
+
+    Every request waits `latency` seconds and fails with a retryable
+    (503) APIError with probability `error_rate`. Webhooks are sent through
+    `webhook_transport` when given (e.g. httpx.ASGITransport(app=app) to
+    stay in-process), else over HTTP to `webhook_url`.
+    """
+
+    def __init__(
+        self,
+        latency: float = FAKE_SUPABASE_LATENCY,
+        error_rate: float = FAKE_SUPABASE_ERROR_RATE,
+        webhook_url: str = FAKE_SUPABASE_WEBHOOK_URL,
+        webhook_transport: Optional[httpx.AsyncBaseTransport] = None,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.webhook_url = webhook_url or "http://fake-supabase-webhooks"
+        self.webhook_transport = webhook_transport
+        self.webhooks_enabled = bool(webhook_url or webhook_transport)
+        self.random = random.Random(seed)
+        self.tables: Dict[str, List[dict]] = {}
+        self.ids = itertools.count(1)
+        self.tokens: Dict[str, str] = {}  # {access_token: user_id}
+        self.auth = FakeAuth(self)
+        self.webhook_tasks = set()
+        self.stats = {"requests": 0, "errors": 0, "webhooks": 0, "webhook_errors": 0}
+        self._webhook_client: Optional[httpx.AsyncClient] = None
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def schema(self, name: str) -> "FakeSupabase":
+        return self
+
+    async def before_request(self, inject_errors: bool = True):
+        self.stats["requests"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if inject_errors and self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            raise APIError({"code": "503", "message": "Injected fake Supabase error"})
+
+    def issue_token(self, user_id: str, secret: Optional[str] = None) -> str:
+        """Mint an access token for `user_id`. With `secret` (the value of
+        SUPABASE_JWT_SECRET) it is a valid HS256 JWT, so local verification in
+        utils.jwtVerify accepts it as well as `auth.get_user`. The issuer is
+        SUPABASE_URL's auth endpoint when that is set, as Supabase's is."""
+
+        def encode(value) -> str:
+            raw = value if isinstance(value, bytes) else json.dumps(value).encode()
+            return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+        header = encode({"alg": "HS256", "typ": "JWT"})
+        payload = {
+            "sub": user_id,
+            "aud": "authenticated",
+            "exp": int(time.time()) + 3600,
+        }
+        supabase_url = os.getenv("SUPABASE_URL")
+        if supabase_url:
+            payload["iss"] = f"{supabase_url.rstrip('/')}/auth/v1"
+        claims = encode(payload)
+        signing_input = f"{header}.{claims}".encode("ascii")
+        signature = hmac.new(
+            (secret or "fake-supabase").encode("utf-8"), signing_input, hashlib.sha256
+        ).digest()
+        token = f"{header}.{claims}.{encode(signature)}"
+        self.tokens[token] = user_id
+        return token
+
+    def insert_row(self, table: str, record: dict) -> dict:
+        row = dict(record)
+        row.setdefault("id", next(self.ids))
+        row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        self.tables.setdefault(table, []).append(row)
+
+        if table == NEWSLETTER_TABLE:
+            self.send_webhook(
+                "/ai/refineText",
+                {
+                    "id": row["id"],
+                    "user_id": row.get("user_id"),
+                    "parsed_text": row.get("parsed_text"),
+                },
+            )
+        return row
+
+    def update_row(self, table: str, row: dict, values: dict):
+        had_refined_text = bool(row.get("refined_text"))
+        row.update({k: v for k, v in values.items() if k != "id"})
+
+        if (
+            table == NEWSLETTER_TABLE
+            and row.get("refined_text")
+            and not had_refined_text
+        ):
+            user_id = row.get("user_id")
+            records = [
+                copy.deepcopy(r)
+                for r in self.tables[table]
+                if r.get("user_id") == user_id
+                and r.get("refined_text")
+                and not r.get("episode_flag")
+            ]
+            self.send_webhook(
+                "/ai/episodeLimitCheck", {"user_id": user_id, "records": records}
+            )
+
+    def send_webhook(self, path: str, payload: dict):
+        if not self.webhooks_enabled:
+            return
+        task = asyncio.get_running_loop().create_task(self.post_webhook(path, payload))
+        self.webhook_tasks.add(task)
+        task.add_done_callback(self.webhook_tasks.discard)
+
+    async def post_webhook(self, path: str, payload: dict):
+        if self._webhook_client is None:
+            self._webhook_client = httpx.AsyncClient(
+                base_url=self.webhook_url, transport=self.webhook_transport, timeout=30
+            )
+        self.stats["webhooks"] += 1
+        try:
+            response = await self._webhook_client.post(path, json=payload)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{response.status_code} {response.text}")
+        except Exception as e:
+            self.stats["webhook_errors"] += 1
+            print(f"Fake Supabase webhook {path} failed: {e}")
+
+    async def drain(self):
+        """Wait until every webhook fired so far (and any they caused) is sent."""
+        while self.webhook_tasks:
+            await asyncio.gather(*list(self.webhook_tasks), return_exceptions=True)
+
+    async def aclose(self):
+        await self.drain()
+        if self._webhook_client is not None:
+            await self._webhook_client.aclose()
+            self._webhook_client = None
@@ -5,13 +5,22 @@ import requests
 from router.gmailAuth import auth_router
 from router.fetchSender import email_router
 from router.aiProcessing import ai_router
+from router.episodes import episode_router
 from utils.supabaseUtils import (
     init_global_instance,
     supabase_func_instance,
     SupaBaseFunc,
     fetchEpisodes,
+    close_rest_transport,
 )
 from fastapi.responses import JSONResponse
+from utils.gmailClient import gmail_client
+from utils.extractPool import extract_pool
+from utils.writeBehind import refined_text_writes
+from utils.tokenCount import token_counter
+from utils.llmScheduler import llm_scheduler
+from utils.aiProcessingUtils import EPISODE_MODEL, REFINE_MODEL
+from utils.metrics import metrics
 
 app = FastAPI()
 
@@ -21,11 +30,25 @@ async def startup_event():
     """Ensure Supabase clients are initialized when FastAPI starts."""
     await init_global_instance()
     print("✅ Supabase global instance created!")
+    # Load tokenizers now rather than on the first request that counts tokens
+    await token_counter.warm_up([REFINE_MODEL, EPISODE_MODEL])
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Write buffered row updates, then close pooled connections and workers."""
+    await refined_text_writes.aclose()
+    await gmail_client.aclose()
+    await llm_scheduler.aclose()
+    await close_rest_transport()
+    extract_pool.shutdown()
+    token_counter.shutdown()
 
 
 app.include_router(auth_router)
 app.include_router(email_router, prefix="/email")
 app.include_router(ai_router, prefix="/ai")
+app.include_router(episode_router, prefix="/episodes")
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,6 +59,12 @@ app.add_middleware(
 )
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Pipeline counters and latency observations for this worker."""
+    return metrics.snapshot()
+
+
 # @app.get("/get_episodes")
 # async def get_notes(Authorization: str = Header(...)):
 #     """
@@ -0,0 +1,161 @@
+import base64
+import binascii
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import AsyncGenerator, Literal, Optional
+
+from dotenv import load_dotenv
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from Middleware.authMiddleware import get_current_user
+from utils.supabaseUtils import scoped_postgrest
+
+load_dotenv()
+
+episode_router = APIRouter()
+
+EPISODES_PAGE_SIZE = int(os.getenv("EPISODES_PAGE_SIZE", "25"))  # Rows per query
+EPISODES_MAX_LIMIT = int(os.getenv("EPISODES_MAX_LIMIT", "500"))
+
+EPISODE_COLUMNS = {
+    "list": "id, created_at, newsletter_emails",
+    "full": "id, created_at, newsletter_emails, episode",
+}
+
+
+def encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    """(created_at, id) from a cursor. Both end up in a filter string, so
+    created_at must be an ISO-8601 timestamp and id an int or UUID."""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        datetime.fromisoformat(created_at)
+        if isinstance(row_id, bool) or not isinstance(row_id, (int, str)):
+            raise ValueError("Cursor id must be an int or UUID")
+        if isinstance(row_id, str):
+            row_id = str(uuid.UUID(row_id))
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, row_id
+
+
+async def fetch_page(client, user_id: str, columns: str, after, size: int) -> list:
+    """Next `size` episodes, newest first, strictly after the (created_at, id)
+    keyset position `after`."""
+    query = (
+        client.table("episodes")
+        .select(columns)
+        .eq("user_id", user_id)
+        .order("created_at", desc=True)
+        .order("id", desc=True)
+        .limit(size)
+    )
+    if after is not None:
+        created_at, row_id = after
+        query = query.or_(
+            f'created_at.lt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.lt."{row_id}")'
+        )
+    return (await query.execute()).data
+
+
+def render_episode(row: dict) -> str:
+    episode = row.get("episode")
+    if isinstance(episode, str):
+        try:
+            row = dict(row, episode=json.loads(episode))
+        except json.JSONDecodeError:
+            pass  # Serve what was stored
+    return json.dumps(row)
+
+
+def page_size(limit: int, sent: int) -> int:
+    remaining = limit - sent
+    if remaining > EPISODES_PAGE_SIZE:
+        return EPISODES_PAGE_SIZE
+    # The final page asks for one row past the limit to tell whether another
+    # page follows, even when that makes it one row longer than the others
+    return remaining + 1
+
+
+async def stream_episodes(
+    client, user_id: str, columns: str, first_page: list, limit: int
+) -> AsyncGenerator[str, None]:
+    """Stream `{"episodes": [...], "next_cursor": ...}` one row at a time,
+    querying the next page only after the previous one has been written."""
+    page, requested = first_page, page_size(limit, 0)
+    sent = 0
+    last_row = None
+    has_more = False
+    error = None
+    yield '{"episodes":['
+
+    while True:
+        for row in page[: limit - sent]:
+            yield ("," if sent else "") + render_episode(row)
+            sent += 1
+            last_row = row
+        if len(page) < requested:
+            break  # No more rows
+        if sent >= limit:
+            has_more = True
+            break
+
+        requested = page_size(limit, sent)
+        try:
+            page = await fetch_page(
+                client,
+                user_id,
+                columns,
+                (last_row["created_at"], last_row["id"]),
+                requested,
+            )
+        except Exception as e:
+            print(f"Error fetching episodes page: {e}")
+            error = "Failed to fetch the remaining episodes"
+            break
+
+    next_cursor = encode_cursor(last_row) if last_row and (has_more or error) else None
+    tail = f'],"next_cursor":{json.dumps(next_cursor)}'
+    if error:
+        tail += f',"error":{json.dumps(error)}'
+    yield tail + "}"
+
+
+@episode_router.get("", response_class=StreamingResponse)
+async def list_episodes(
+    view: Literal["list", "full"] = Query("list"),
+    limit: int = Query(50, ge=1, le=EPISODES_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    supabase_access_token: str = Header(...),
+    user_id: str = Depends(get_current_user),
+):
+    """
+    The user's episodes, newest first. `view=list` omits the episode body;
+    `view=full` includes it as JSON. Pass `next_cursor` back as `cursor` for
+    the following page.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    columns = EPISODE_COLUMNS[view]
+    # Queries run with the user's own token, so row level security applies
+    client = scoped_postgrest(supabase_access_token)
+
+    try:
+        first_page = await fetch_page(
+            client, user_id, columns, after, page_size(limit, 0)
+        )
+    except Exception as e:
+        print(f"Error fetching episodes: {e}")
+        raise HTTPException(status_code=502, detail="Failed to fetch episodes")
+
+    return StreamingResponse(
+        stream_episodes(client, user_id, columns, first_page, limit),
+        media_type="application/json",
+    )
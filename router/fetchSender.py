@@ -3,11 +3,13 @@ from fastapi.responses import StreamingResponse
 from fastapi import Depends, APIRouter, Header, HTTPException, Request
 from controllers.fetchEmailSenders import FetchEmailSenders
 from pydantic import BaseModel
-from typing import Dict
+from typing import Dict, Optional
 from controllers.fetchEmailContent import EmailContentFetcher
-from utils.saveEmailUtil import save_emails_batch
-import asyncio
+from utils.saveEmailUtil import save_emails_stream
+from utils.mailManager import mail_manager
+from utils.aiProcessingUtils import finish_if_webhooks_caught_up
 from Middleware.authMiddleware import get_current_user
+from utils.scanSessions import scan_sessions
 
 email_router = APIRouter()
 
@@ -20,18 +22,30 @@ class EmailSendersRequest(BaseModel):
 @email_router.get("/senders", response_class=StreamingResponse)
 async def stream_email_senders_endpoint(
     google_access_token: str = Query(..., description="Google API Access Token"),
+    last_event_id: Optional[str] = Header(None),
     # user_access_token: str = Query(
     #     ..., description="User's login token for validation"
     # ),
 ):
-    """Streams email senders in real-time as they are fetched."""
-
-    email_fetcher = FetchEmailSenders()
-    # Here, you can validate `user_access_token` if necessary
-
-    # Return an SSE response using the generator function
+    """Streams email senders in real-time as they are fetched. A reconnect
+    carrying Last-Event-ID resumes the running (or recently finished) scan
+    instead of starting a new one."""
+
+    session, after_seq = scan_sessions.resume(last_event_id, google_access_token)
+    if session is None:
+        email_fetcher = FetchEmailSenders()
+        # Here, you can validate `user_access_token` if necessary
+        session = scan_sessions.start(
+            google_access_token,
+            email_fetcher.stream_all_messages(google_access_token),
+        )
+        after_seq = 0
+    else:
+        print(f"Resuming sender scan {session.scan_id} after event {after_seq}")
+
+    # Return an SSE response using the session's frame log
     return StreamingResponse(
-        email_fetcher.stream_all_messages(google_access_token),
+        session.stream(after_seq),
         media_type="text/event-stream",
     )
 
@@ -56,21 +70,25 @@ async def send_selected(
         access_token=google_access_token, user_id=user_id
     )
 
-    # Run blocking fetch function in an async-friendly way
-    try:
-        emails = await asyncio.to_thread(contentFetcher.fetch_recent_emails, senders)
-
-        # print("Fetched email results:", emails)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch emails: {str(e)}")
+    # The final count is only known once the stream ends; clear any stale one
+    # so early webhooks can't match it
+    mail_manager.delete_user_mail(user_id)
 
-    # Save emails asynchronously
+    # Fetch, parse, dedupe and save in one streaming pass
     try:
-        await save_emails_batch(user_id, emails)
-        # save_emails_batch(user_id, emails)
-        # await asyncio.to_thread(save_emails_batch, user_id, emails)
-        print("Saves the content")
+        result = await save_emails_stream(
+            user_id, contentFetcher.iter_unique_emails(senders)
+        )
+        print("Saves the content", result.get("message"))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save emails: {str(e)}")
 
-    return {"message": "Data received successfully"}
+    print("Total Emails", contentFetcher.email_count)
+    mail_manager.set_user_mails(userID=user_id, mailCount=contentFetcher.email_count)
+    if contentFetcher.email_count:
+        await finish_if_webhooks_caught_up(user_id)
+
+    return {
+        "message": "Data received successfully",
+        "llm_calls_saved": sum(contentFetcher.dedup_stats.values()),
+    }
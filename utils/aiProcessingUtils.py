@@ -1,31 +1,141 @@
+import json
 import traceback
 import time
 import asyncio
 from fastapi import HTTPException
-from utils.refineTextPrompt import prompt
-from utils.episodePrompt import episodePrompt
-from openai import AsyncOpenAI
+from utils.refineTextPrompt import prompt, refine_messages
+from utils.episodePrompt import episode_messages
 import os
-from utils.tokenCount import count_tokens
+from utils.tokenCount import token_counter
 from utils.mailManager import mail_manager
+from utils.refineCache import refine_cache
+from utils.writeBehind import refined_text_writes
+from utils.textChunking import chunk_text
+from utils.episodePacking import pack_episodes
+from utils.incrementalJson import IncrementalObjectParser
+from utils.metrics import metrics
+from utils.llmScheduler import PRIORITY_EPISODE, PRIORITY_REFINE, llm_scheduler
 
 
+REFINE_MODEL = "gpt-4o-mini"
+EPISODE_MODEL = "gpt-4o"
+
+# Chunks of one oversized newsletter refined at the same time
+REFINE_CHUNK_CONCURRENCY = int(os.getenv("REFINE_CHUNK_CONCURRENCY", "4"))
+
+metrics.track_ratio(
+    "refine.chunked_rate", "refine.chunked_inputs", "refine.single_inputs"
+)
+
 processing_lock = asyncio.Lock()
 processing_records = {}
-key = os.getenv("OPENAI_API_KEY")
 
-# Initialize your asynchronous OpenAI client.
-client = AsyncOpenAI(api_key=key)
+
+async def stream_episode(history, user_id, unique_emails):
+    """
+    Generate an episode with a streamed completion. When the first main
+    topic closes, the episode row is inserted with the name and that topic.
+    The row is updated as each later topic closes, so the app can start on
+    topic 1 while the rest is still being written.
+
+    Returns (episode_text, episode_id). episode_id is None if no topic
+    closed during the stream. On errors the partial row is deleted.
+    """
+    from utils.supabaseUtils import supabase_func_instance
+
+    started = time.perf_counter()
+    parser = IncrementalObjectParser()
+    parts = []
+    episode = {}
+    episode_id = None
+
+    try:
+        # Call the OpenAI model, ahead of any queued refine calls
+        stream = await llm_scheduler.create(
+            priority=PRIORITY_EPISODE,
+            model=EPISODE_MODEL,
+            messages=history,
+            temperature=0,
+            response_format={"type": "json_object"},  # Force JSON response
+            stream=True,
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            parts.append(delta)
+            if parser is None:
+                continue
+
+            try:
+                members = parser.feed(delta)
+            except json.JSONDecodeError:
+                parser = None  # Left to the check on the full response
+                continue
+            topics = [key for key, value in members if isinstance(value, dict)]
+            episode.update(members)
+            if not topics:
+                continue  # e.g. EpisodeName
+
+            if episode_id is None:
+                metrics.observe(
+                    "episodes.time_to_first_topic_ms",
+                    (time.perf_counter() - started) * 1000,
+                )
+                result = (
+                    await supabase_func_instance.supabase.table("episodes")
+                    .insert(
+                        {
+                            "episode": json.dumps(episode),
+                            "newsletter_emails": unique_emails,
+                            "user_id": user_id,
+                        }
+                    )
+                    .execute()
+                )
+                episode_id = result.data[0]["id"]
+                print(f"🎧 Episode {episode_id} started with topic '{topics[0]}'")
+            else:
+                await (
+                    supabase_func_instance.supabase.table("episodes")
+                    .update({"episode": json.dumps(episode)})
+                    .eq("id", episode_id)
+                    .execute()
+                )
+            metrics.incr("episodes.topics_streamed", len(topics))
+    except Exception:
+        if episode_id is not None:
+            await delete_partial_episode(episode_id)
+        raise
+
+    metrics.observe("episodes.generation_ms", (time.perf_counter() - started) * 1000)
+    return "".join(parts).strip(), episode_id
 
 
-async def create_episode_with_llm(records, record_ids, user_id):
+async def delete_partial_episode(episode_id):
+    from utils.supabaseUtils import supabase_func_instance
+
+    try:
+        await (
+            supabase_func_instance.supabase.table("episodes")
+            .delete()
+            .eq("id", episode_id)
+            .execute()
+        )
+        print(f"Deleted partial episode {episode_id}")
+    except Exception as e:
+        print(f"❌ Error deleting partial episode {episode_id}: {e}")
+
+
+async def create_episode_with_llm(records, record_ids, user_id, finalize=True):
     """
     Background task to process text with LLM and update the database.
     This function runs independently of the HTTP request/response cycle.
+    With `finalize=False` the caller does the end-of-import bookkeeping.
     """
     from utils.supabaseUtils import supabase_func_instance
 
-    final_process = mail_manager.compare_webhook_email(user_id)
+    final_process = finalize and mail_manager.compare_webhook_email(user_id)
     mail_manager.update_bg_task(user_id)
 
     try:
@@ -60,45 +170,41 @@ async def create_episode_with_llm(records, record_ids, user_id):
         print(f"📩 Processing episode for {len(filtered_records)} newsletters")
 
         # Prepare the conversation history
-        history = [
-            {
-                "role": "system",
-                "content": episodePrompt,
-            },
-            {"role": "user", "content": news_letter_content_str},
-        ]
-
-        # Call the OpenAI model
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=history,
-            temperature=0,
-            response_format={"type": "json_object"},  # Force JSON response
-        )
+        history = episode_messages(news_letter_content_str)
 
-        episode_text = response.choices[0].message.content.strip()
+        # Streamed, so the episode row exists as soon as its first topic does
+        episode_text, episode_id = await stream_episode(
+            history, user_id, unique_emails
+        )
 
         # print(episode_text)
 
-        import json
-
         try:
             episode_data = json.loads(episode_text)
             print(f"✅ Successfully generated episode with {len(episode_data)} topics")
 
-            # Create a new entry in the episode table
-            episode_insert_data = {
-                "episode": episode_text,  # Store the full JSON response
-                "newsletter_emails": unique_emails,  # List of unique emails
-                "user_id": user_id,  # User ID passed to the function
-            }
-
-            # Insert the new episode record
-            episode_result = (
-                await supabase_func_instance.supabase.table("episodes")
-                .insert(episode_insert_data)
-                .execute()
-            )
+            if episode_id is None:
+                # Create a new entry in the episode table
+                episode_insert_data = {
+                    "episode": episode_text,  # Store the full JSON response
+                    "newsletter_emails": unique_emails,  # List of unique emails
+                    "user_id": user_id,  # User ID passed to the function
+                }
+
+                # Insert the new episode record
+                episode_result = (
+                    await supabase_func_instance.supabase.table("episodes")
+                    .insert(episode_insert_data)
+                    .execute()
+                )
+            else:
+                # Replace the topics written while streaming with the full response
+                episode_result = (
+                    await supabase_func_instance.supabase.table("episodes")
+                    .update({"episode": episode_text})
+                    .eq("id", episode_id)
+                    .execute()
+                )
             mail_manager.reduce_bg_task(user_id)
 
             # Check if the insert was successful
@@ -131,7 +237,9 @@ async def create_episode_with_llm(records, record_ids, user_id):
                 # if task > 0:
                 #     mail_manager.set_kill_owner(user_id)
                 # else:
-                final_process = mail_manager.compare_webhook_email(user_id)
+                final_process = finalize and mail_manager.compare_webhook_email(
+                    user_id
+                )
                 if final_process:
                     owner = mail_manager.get_kill_owner(user_id)
                     if owner:
@@ -168,6 +276,8 @@ async def create_episode_with_llm(records, record_ids, user_id):
         except json.JSONDecodeError as json_err:
             print(f"❌ Error: LLM didn't return valid JSON: {json_err}")
             print(f"Raw LLM response: {episode_text}")
+            if episode_id is not None:
+                await delete_partial_episode(episode_id)
             return {
                 "success": False,
                 "error": f"Invalid JSON response from LLM: {str(json_err)}",
@@ -255,125 +365,71 @@ async def process_episode_limits(records, user_id):
             eligible_records, key=lambda r: r.get("sent_time", ""), reverse=True
         )
 
-        # STEP 4: Apply your business logic for token limits
-        total_token_count = sum(r.get("token_count", 0) for r in sorted_records)
-
-        # Case 1: If the total token count is less than 3500
-        if total_token_count < 3500:
-            if len(sorted_records) >= 3:
-                record_ids_to_update = [r["id"] for r in sorted_records]
-                print(
-                    f"Updating episode flags for {len(record_ids_to_update)} records with total token count {total_token_count}"
-                )
-                # await updateFlag(record_ids_to_update, supabase_func_instance)
-                await create_episode_with_llm(records, record_ids_to_update, user_id)
-
-                # Mark as completed in our tracking
-                async with processing_lock:
-                    for rid in record_ids_to_update:
-                        if rid in processing_records:
-                            processing_records[rid]["status"] = "completed"
+        # STEP 4: Pack the records into as many episodes as the limits allow
+        episodes, leftovers = pack_episodes(sorted_records)
+        metrics.observe("episodes.per_webhook", len(episodes))
+        metrics.incr("episodes.leftover_records", len(leftovers))
 
-                return {"record_ids": record_ids_to_update}
-            else:
-                print("Not enough records to create the episodes (need at least 3)")
-                # Release the processing locks
-                async with processing_lock:
-                    for r in sorted_records:
-                        if r["id"] in processing_records:
-                            del processing_records[r["id"]]
-
-                final_process = mail_manager.compare_webhook_email(user_id)
-
-                if final_process:
-                    task = mail_manager.get_bg_task(user_id)
-                    print(task, "Outside LLM Episode function")
-                    if task > 0:
-                        mail_manager.set_kill_owner(user_id)
-                    else:
-                        response = await supabase_func_instance.updateProfileData(
-                            table_name="profiles",
-                            user_id=user_id,
-                            columnName="episode_processing",
-                            value=True,
-                        )
-                        if response:
-                            print("Profile flag updated")
-
-                        mail_manager.delete_all_counts(user_id)
-                        print(
-                            "🔴🔴🔴 Last processing outside the  create_episode_with_llm"
-                        )
-                else:
-                    print("🟢🟢🟢 Still going")
-                return
-
-        # Case 2: If token count exceeds 3500, drop newest records one by one
-        records_to_process = sorted_records.copy()
-        records_to_skip = []
-
-        while total_token_count > 3500 and records_to_process:
-            # Remove the newest record
-            if len(records_to_process) == 1:
-                break
-
-            skipped_record = records_to_process.pop(0)
-            records_to_skip.append(skipped_record["id"])
-            total_token_count = sum(r.get("token_count", 0) for r in records_to_process)
-
-        # Release locks for skipped records
+        # Release locks for records left over; a later webhook brings them back
         async with processing_lock:
-            for rid in records_to_skip:
-                if rid in processing_records:
-                    del processing_records[rid]
+            for r in leftovers:
+                if r["id"] in processing_records:
+                    del processing_records[r["id"]]
 
-        # After dropping records, check if we have enough
-        if total_token_count < 3500:
-            if len(records_to_process) >= 1:
-                record_ids_to_update = [r["id"] for r in records_to_process]
-                print(
-                    f"After dropping {len(records_to_skip)} records, updating episode flags for {len(record_ids_to_update)} records"
-                )
-                # await updateFlag(record_ids_to_update, supabase_func_instance)
-                await create_episode_with_llm(records, record_ids_to_update, user_id)
+        if not episodes:
+            print("Not enough records to create the episodes (need at least 3)")
+            await finish_episode_processing(user_id)
+            return
 
-                # Mark as completed
-                async with processing_lock:
-                    for rid in record_ids_to_update:
-                        if rid in processing_records:
-                            processing_records[rid]["status"] = "completed"
+        if len(episodes) == 1:
+            record_ids_to_update = [r["id"] for r in episodes[0]]
+            total_token_count = sum(r.get("token_count") or 0 for r in episodes[0])
+            print(
+                f"Updating episode flags for {len(record_ids_to_update)} records with total token count {total_token_count}"
+            )
+            await create_episode_with_llm(records, record_ids_to_update, user_id)
 
-                return {"record_ids": record_ids_to_update}
-            else:
-                print("Not enough records to create the episodes after filtering")
-        else:
-            print("Could not reduce token count below 3500")
+            # Mark as completed in our tracking
+            async with processing_lock:
+                for rid in record_ids_to_update:
+                    if rid in processing_records:
+                        processing_records[rid]["status"] = "completed"
 
-        final_process = mail_manager.compare_webhook_email(user_id)
-        if final_process:
-            task = mail_manager.get_bg_task(user_id)
-            if task > 0:
-                mail_manager.set_kill_owner(user_id)
-            else:
-                response = await supabase_func_instance.updateProfileData(
-                    table_name="profiles",
-                    user_id=user_id,
-                    columnName="episode_processing",
-                    value=True,
-                )
-                if response:
-                    print("Profile flag updated")
+            return {"record_ids": record_ids_to_update}
 
-                mail_manager.delete_all_counts(user_id)
-                print("🔴🔴🔴 Last processing outside the  create_episode_with_llm")
-        else:
-            print("🟢🟢🟢 Still going")
-        # Release any remaining locks if we didn't process
+        print(
+            f"Packing {len(sorted_records)} records into {len(episodes)} episodes, "
+            f"{len(leftovers)} left over"
+        )
+        episode_record_ids = [[r["id"] for r in episode] for episode in episodes]
+        # Generated concurrently; the end-of-import bookkeeping runs once
+        # after all of them instead of inside each
+        results = await asyncio.gather(
+            *(
+                create_episode_with_llm(records, ids, user_id, finalize=False)
+                for ids in episode_record_ids
+            ),
+            return_exceptions=True,
+        )
 
+        record_ids_to_update = []
         async with processing_lock:
-            for r in records_to_process:
-                if r["id"] in processing_records:
-                    del processing_records[r["id"]]
+            for ids, result in zip(episode_record_ids, results):
+                failed = isinstance(result, Exception)
+                if failed:
+                    print(f"❌ Episode for records {ids} failed: {result}")
+                else:
+                    record_ids_to_update.extend(ids)
+                for rid in ids:
+                    if rid not in processing_records:
+                        continue
+                    if failed:
+                        del processing_records[rid]
+                    else:
+                        processing_records[rid]["status"] = "completed"
+
+        await finish_episode_processing(user_id)
+        return {"record_ids": record_ids_to_update}
 
     except Exception as e:
         print(f"❌ Error in process_episode_limits: {str(e)}")
@@ -387,6 +443,68 @@ async def process_episode_limits(records, user_id):
             print(f"Error while cleaning up locks: {cleanup_error}")
 
 
+async def finish_episode_processing(user_id):
+    """
+    End-of-import bookkeeping for a webhook whose own episode calls didn't
+    do it: once every expected webhook has arrived, mark the profile done,
+    or leave that to an episode still generating.
+    """
+    from utils.supabaseUtils import supabase_func_instance
+
+    final_process = mail_manager.compare_webhook_email(user_id)
+
+    if final_process:
+        task = mail_manager.get_bg_task(user_id)
+        print(task, "Outside LLM Episode function")
+        if task and task > 0:
+            mail_manager.set_kill_owner(user_id)
+        else:
+            response = await supabase_func_instance.updateProfileData(
+                table_name="profiles",
+                user_id=user_id,
+                columnName="episode_processing",
+                value=True,
+            )
+            if response:
+                print("Profile flag updated")
+
+            mail_manager.delete_all_counts(user_id)
+            print("🔴🔴🔴 Last processing outside the  create_episode_with_llm")
+    else:
+        print("🟢🟢🟢 Still going")
+
+
+async def finish_if_webhooks_caught_up(user_id):
+    """
+    Run the end-of-import bookkeeping when every expected webhook already
+    arrived before the mail count was set (emails are saved while they are
+    still being fetched, so the count is only known at the end).
+    """
+    from utils.supabaseUtils import supabase_func_instance
+
+    if not mail_manager.compare_webhook_email(user_id):
+        print("🟢🟢🟢 Still going")
+        return False
+
+    task = mail_manager.get_bg_task(user_id)
+    if task and task > 0:
+        mail_manager.set_kill_owner(user_id)
+        return False
+
+    response = await supabase_func_instance.updateProfileData(
+        table_name="profiles",
+        user_id=user_id,
+        columnName="episode_processing",
+        value=True,
+    )
+    if response:
+        print("Profile flag updated")
+
+    mail_manager.delete_all_counts(user_id)
+    print("🔴🔴🔴 Last processing after send_selected")
+    return True
+
+
 async def updateFlag(record_ids, func_instance):
     """Update episode flags for the given record IDs"""
     try:
@@ -409,62 +527,67 @@ async def updateFlag(record_ids, func_instance):
         raise HTTPException(status_code=500, detail="Failed to update records")
 
 
+async def refine_chunk(parsed_text: str) -> str:
+    """Refine one newsletter (or one chunk of a long one) with the LLM."""
+    started = time.perf_counter()
+    # Static instructions first, newsletter text last
+    history = refine_messages(parsed_text)
+
+    # Call the OpenAI model
+    response = await llm_scheduler.create(
+        priority=PRIORITY_REFINE,
+        model=REFINE_MODEL,
+        messages=history,
+        temperature=0,
+    )
+    metrics.observe("refine.chunk_latency_ms", (time.perf_counter() - started) * 1000)
+    return response.choices[0].message.content.strip()
+
+
 async def process_text_with_llm(record_id: str, parsed_text: str, user_id: str):
     """
     Background task to process text with LLM and update the database.
     This function runs independently of the HTTP request/response cycle.
     """
-    from utils.supabaseUtils import supabase_func_instance
-
-    max_retries = 3
     try:
-        # Format the prompt and prepare history
-        formatted_prompt = prompt.format(
-            parsed_text=parsed_text,
-        )
-        history = [
-            {
-                "role": "system",
-                "content": formatted_prompt,
-            }
-        ]
 
-        # Call the OpenAI model
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=history,
-            temperature=0,
-        )
+        async def refine():
+            metrics.observe(
+                "refine.input_tokens_estimate", token_counter.estimate(parsed_text)
+            )
+            chunks = await chunk_text(parsed_text, REFINE_MODEL)
+            if len(chunks) == 1:
+                metrics.incr("refine.single_inputs")
+                refined_text = await refine_chunk(parsed_text)
+            else:
+                metrics.incr("refine.chunked_inputs")
+                metrics.observe("refine.chunks_per_input", len(chunks))
+                print(f"Refining record {record_id} in {len(chunks)} chunks")
+                slots = asyncio.Semaphore(REFINE_CHUNK_CONCURRENCY)
+
+                async def refine_in_slot(chunk: str) -> str:
+                    async with slots:
+                        return await refine_chunk(chunk)
+
+                # Refined concurrently, then stitched back together in order
+                refined_chunks = await asyncio.gather(
+                    *(refine_in_slot(chunk) for chunk in chunks)
+                )
+                refined_text = "\n\n".join(c for c in refined_chunks if c)
 
-        refined_text = response.choices[0].message.content.strip()
-        token = count_tokens(refined_text)
+            token = await token_counter.count_async(refined_text, REFINE_MODEL)
+            return refined_text, token
+
+        # Identical newsletters sent to other users are refined only once
+        refined_text, token = await refine_cache.get_or_refine(
+            parsed_text, REFINE_MODEL, prompt, refine
+        )
         print(f"Token count: {token}")
 
         update_data = {"refined_text": refined_text, "token_count": token}
-        for attempt in range(max_retries):
-
-            result = (
-                await supabase_func_instance.supabase.table("user_news_letters")
-                .update(update_data)
-                .eq("id", record_id)
-                .execute()
-            )
-            # Check if there is at least one row in "data"
-            if len(result.data) > 0:
-                # We successfully updated at least one row, so break out
-                print(f"Row updated on attempt #{attempt+1}")
-                break
-            else:
-                print(f"No row updated on attempt #{attempt+1}... retrying...")
-                await asyncio.sleep(0.5)
-
-        # Check if the result indicates success
-        if result:
-            print(
-                f"✅ Refine Text Update successful: {record_id} \n {result} \n {update_data}"
-            )
-        else:
-            print(result)
+        # Buffered and flushed together with other records' updates; rows not
+        # visible yet are retried by the buffer
+        await refined_text_writes.update(record_id, update_data, user_id)
 
     except Exception as e:
         mail_manager.reduce_user_mail(userID=user_id)
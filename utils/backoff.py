@@ -0,0 +1,10 @@
+import random
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Seconds to wait before retry number `attempt` (1-based): exponential
+    backoff from `base`, capped at `cap`, with full jitter so concurrent
+    retries spread out instead of arriving together.
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
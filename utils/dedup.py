@@ -0,0 +1,109 @@
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Max differing bits between two 64-bit SimHashes for a near-duplicate
+DEDUP_SIMHASH_DISTANCE = int(os.getenv("DEDUP_SIMHASH_DISTANCE", "3"))
+# Texts shorter than this (in words) are only matched exactly
+DEDUP_MIN_TOKENS = int(os.getenv("DEDUP_MIN_TOKENS", "30"))
+DEDUP_SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", "3"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "2000"))
+
+URL_RE = re.compile(r"https?://\S+|www\.\S+")
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str):
+    """Lowercase words with links removed (tracking URLs differ per recipient)."""
+    return TOKEN_RE.findall(URL_RE.sub(" ", text.lower()))
+
+
+def content_hash(tokens) -> str:
+    return hashlib.sha256(" ".join(tokens).encode("utf-8")).hexdigest()
+
+
+def simhash(tokens, shingle_size: int = DEDUP_SHINGLE_SIZE) -> int:
+    """64-bit SimHash over word shingles."""
+    weights = [0] * 64
+    for i in range(max(len(tokens) - shingle_size + 1, 1)):
+        shingle = " ".join(tokens[i : i + shingle_size]).encode("utf-8")
+        value = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class DedupIndex:
+    """
+    Fingerprints of the emails accepted so far in one fetch. It is built
+    per request: emails are fingerprinted before they are saved, so an index
+    that outlived the request would drop them on a retry or a re-import.
+
+    Exact duplicates are found by a hash of the normalized text. Near
+    duplicates are found by SimHash: the 64 bits are split into
+    `max_distance + 1` bands, so any fingerprint within `max_distance` bits
+    shares at least one whole band with a match and only those candidates
+    are compared.
+    """
+
+    def __init__(self, max_distance: int = DEDUP_SIMHASH_DISTANCE):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        self.band_bits = 64 // bands
+        self.band_count = bands
+        self.exact = OrderedDict()  # {content_hash: simhash or None}
+        self.bands = [dict() for _ in range(bands)]  # [{band_value: set(simhash)}]
+
+    def band_values(self, fingerprint: int):
+        mask = (1 << self.band_bits) - 1
+        for band in range(self.band_count):
+            yield band, fingerprint >> (band * self.band_bits) & mask
+
+    def find_near(self, fingerprint: int) -> Optional[int]:
+        for band, value in self.band_values(fingerprint):
+            for candidate in self.bands[band].get(value, ()):
+                if bin(candidate ^ fingerprint).count("1") <= self.max_distance:
+                    return candidate
+        return None
+
+    def add(self, digest: str, fingerprint: Optional[int]):
+        self.exact[digest] = fingerprint
+        if fingerprint is not None:
+            for band, value in self.band_values(fingerprint):
+                self.bands[band].setdefault(value, set()).add(fingerprint)
+
+        while len(self.exact) > DEDUP_MAX_ENTRIES:
+            _, old_fingerprint = self.exact.popitem(last=False)
+            if old_fingerprint is not None:
+                for band, value in self.band_values(old_fingerprint):
+                    bucket = self.bands[band].get(value)
+                    if bucket:
+                        bucket.discard(old_fingerprint)
+
+    def check_and_add(self, text: str) -> Optional[str]:
+        """Return "exact" or "near" when `text` duplicates an earlier email,
+        otherwise remember it and return None."""
+        tokens = tokenize(text)
+        digest = content_hash(tokens)
+        if digest in self.exact:
+            return "exact"
+
+        fingerprint = None
+        if len(tokens) >= DEDUP_MIN_TOKENS:
+            fingerprint = simhash(tokens)
+            if self.find_near(fingerprint) is not None:
+                return "near"
+
+        self.add(digest, fingerprint)
+        return None
@@ -1,4 +1,7 @@
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from functools import lru_cache
 import base64
 import os
 from dotenv import load_dotenv
@@ -19,4 +22,17 @@ class Cryption:
     def decrypt_token(encrypted_token: str) -> str:
         return cipher.decrypt(encrypted_token.encode()).decode()
 
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def user_cipher(user_key: str, purpose: str = "message-cache") -> Fernet:
+        """Fernet cipher for one user's data, derived from SECRET_KEY with HKDF
+        so each user's cached data is encrypted under its own key."""
+        derived = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=f"{purpose}:{user_key}".encode(),
+        ).derive(base64.urlsafe_b64decode(secret_key))
+        return Fernet(base64.urlsafe_b64encode(derived))
+
 cryption = Cryption()
@@ -0,0 +1,102 @@
+import os
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# An episode's newsletters must total fewer tokens than this
+EPISODE_MAX_TOKENS = int(os.getenv("EPISODE_MAX_TOKENS", "3500"))
+EPISODE_MIN_RECORDS = int(os.getenv("EPISODE_MIN_RECORDS", "3"))
+
+
+def tokens(record: dict) -> int:
+    return record.get("token_count") or 0
+
+
+def legacy_bin(records: List[dict], max_tokens: int) -> List[dict]:
+    """
+    The previous rule for more content than one episode holds: drop the
+    newest records until the rest fit, keeping at least one. `records` are
+    sorted newest first. Returns [] when even the oldest doesn't fit.
+    """
+    total = sum(tokens(r) for r in records)
+    start = 0
+    while total >= max_tokens and start < len(records) - 1:
+        total -= tokens(records[start])
+        start += 1
+    return records[start:] if total < max_tokens else []
+
+
+def fill_bins(
+    records: List[dict], count: int, max_tokens: int, min_records: int
+) -> Tuple[List[List[dict]], List[dict]]:
+    """
+    Try to pack `records` into exactly `count` bins. Each bin is seeded with
+    `min_records` of the smallest records, dealt in snake order so the seeds
+    are balanced. Every other record, largest first, then goes to the
+    emptiest bin it fits in (worst fit). Returns ([], records) if the seeds
+    alone overflow a bin.
+    """
+    by_size = sorted(records, key=tokens)
+    seeds, rest = by_size[: count * min_records], by_size[count * min_records :]
+
+    bins = [[] for _ in range(count)]
+    totals = [0] * count
+    for i, record in enumerate(seeds):
+        lap, offset = divmod(i, count)
+        index = offset if lap % 2 == 0 else count - 1 - offset
+        bins[index].append(record)
+        totals[index] += tokens(record)
+    if any(total >= max_tokens for total in totals):
+        return [], records
+
+    leftovers = []
+    for record in reversed(rest):
+        index = min(range(count), key=totals.__getitem__)
+        if totals[index] + tokens(record) < max_tokens:
+            bins[index].append(record)
+            totals[index] += tokens(record)
+        else:
+            leftovers.append(record)
+    return bins, leftovers
+
+
+def pack_episodes(
+    records: List[dict],
+    max_tokens: int = EPISODE_MAX_TOKENS,
+    min_records: int = EPISODE_MIN_RECORDS,
+) -> Tuple[List[List[dict]], List[dict]]:
+    """
+    Partition `records` (sorted newest first) into episodes. Each episode has
+    at least `min_records` records and fewer than `max_tokens` tokens, and
+    there are as many episodes as `fill_bins` can form. Records that fit in
+    none stay over for a later webhook.
+
+    When no such episode exists but there is more than one episode's worth
+    of content, the legacy single bin from `legacy_bin` is used instead.
+    Returns (episodes, leftovers). Each episode keeps the input's order.
+    """
+    order = {id(record): i for i, record in enumerate(records)}
+    fitting = [r for r in records if tokens(r) < max_tokens]
+
+    bins = []
+    upper = len(fitting) // min_records if min_records else len(fitting)
+    for count in range(upper, 0, -1):
+        # Seeding only gets harder with more bins, so take the first count
+        # that packs
+        bins, _ = fill_bins(fitting, count, max_tokens, min_records)
+        if bins:
+            break
+
+    if not bins:
+        total = sum(tokens(r) for r in records)
+        fallback = legacy_bin(records, max_tokens) if total >= max_tokens else []
+        if not fallback:
+            return [], records
+        bins = [fallback]
+
+    packed = {id(r) for episode in bins for r in episode}
+    episodes = [sorted(episode, key=lambda r: order[id(r)]) for episode in bins]
+    leftovers = [r for r in records if id(r) not in packed]
+    return episodes, leftovers
@@ -38,3 +38,14 @@ Your task is to combine the content from these newsletters into a single valid J
    - No extra text, no Markdown, no code fences. Only JSON.
 
 """
+
+
+def episode_messages(newsletter_content: str) -> list:
+    """
+    Chat messages for one episode call: the fixed instructions first, as a
+    cacheable prefix, then the newsletters.
+    """
+    return [
+        {"role": "system", "content": episodePrompt},
+        {"role": "user", "content": newsletter_content},
+    ]
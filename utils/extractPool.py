@@ -0,0 +1,176 @@
+import asyncio
+import base64
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+
+from utils.htmlExtract import clean_text, get_extractor, html_to_text
+
+load_dotenv()
+
+# 0 extracts inline on the event loop thread
+EXTRACT_POOL_WORKERS = int(os.getenv("EXTRACT_POOL_WORKERS", str(os.cpu_count() or 1)))
+EXTRACT_POOL_CHUNK = int(os.getenv("EXTRACT_POOL_CHUNK", "16"))  # Bodies per task
+EXTRACT_POOL_WINDOW = float(os.getenv("EXTRACT_POOL_WINDOW", "0.005"))
+# Smaller bodies cost less to extract than to ship to another process
+EXTRACT_POOL_MIN_BYTES = int(os.getenv("EXTRACT_POOL_MIN_BYTES", "4096"))
+
+# (base64url body data, MIME type, charset)
+BodyItem = Tuple[str, str, str]
+
+
+def body_to_text(body_data: str, mime_type: str, charset: str = "utf-8") -> str:
+    """Decode a Gmail body part and reduce it to cleaned plain text."""
+    raw = base64.urlsafe_b64decode(body_data)
+    try:
+        decoded = raw.decode(charset, errors="replace")
+    except LookupError:
+        decoded = raw.decode("utf-8", errors="replace")
+
+    if mime_type == "text/html":
+        return html_to_text(decoded)
+    return clean_text(decoded)
+
+
+def extract_chunk(items: List[BodyItem]) -> List[Union[str, Exception]]:
+    """
+    Worker entry point: convert a chunk of bodies in one round trip. A body
+    that fails yields its exception in its slot, so the rest of the chunk
+    still comes back.
+    """
+    results = []
+    for item in items:
+        try:
+            results.append(body_to_text(*item))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def warm_up():
+    """Import the extract backend once per worker instead of on its first task."""
+    get_extractor()
+
+
+class ExtractPool:
+    """
+    Runs body decoding and HTML-to-text conversion in worker processes so
+    the CPU-bound part of a fetch doesn't hold the event loop's GIL.
+
+    Calls to `extract` that arrive within EXTRACT_POOL_WINDOW are packed into
+    chunks of up to EXTRACT_POOL_CHUNK bodies, one pool task per chunk, to
+    amortize pickling and IPC. Small bodies and a pool that failed to start
+    are handled inline.
+    """
+
+    def __init__(
+        self,
+        workers: int = EXTRACT_POOL_WORKERS,
+        chunk_size: int = EXTRACT_POOL_CHUNK,
+        window: float = EXTRACT_POOL_WINDOW,
+        min_bytes: int = EXTRACT_POOL_MIN_BYTES,
+    ):
+        self.workers = workers
+        self.chunk_size = max(chunk_size, 1)
+        self.window = window
+        self.min_bytes = min_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: List[Tuple[BodyItem, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._resolving = set()  # Chunk tasks, referenced until they finish
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned workers don't inherit the server's sockets and threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_up,
+            )
+        return self._executor
+
+    async def extract(
+        self, body_data: str, mime_type: str, charset: str = "utf-8"
+    ) -> str:
+        item = (body_data, mime_type, charset)
+        if self.workers <= 0 or len(body_data) < self.min_bytes:
+            return body_to_text(*item)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.chunk_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    async def extract_many(self, items: List[BodyItem]) -> List[str]:
+        """
+        Convert many bodies at once, split into chunks across the pool.
+        Raises the first body's error once all chunks are done.
+        """
+        if self.workers <= 0:
+            texts = extract_chunk(items)
+        else:
+            chunks = [
+                items[i : i + self.chunk_size]
+                for i in range(0, len(items), self.chunk_size)
+            ]
+            results = await asyncio.gather(
+                *(self._run_chunk(chunk) for chunk in chunks)
+            )
+            texts = [text for chunk in results for text in chunk]
+        for text in texts:
+            if isinstance(text, Exception):
+                raise text
+        return texts
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.ensure_future(self._resolve(pending))
+            self._resolving.add(task)
+            task.add_done_callback(self._resolving.discard)
+
+    async def _resolve(self, pending: List[Tuple[BodyItem, asyncio.Future]]):
+        try:
+            texts = await self._run_chunk([item for item, _ in pending])
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), text in zip(pending, texts):
+            if future.done():
+                continue
+            if isinstance(text, Exception):
+                future.set_exception(text)
+            else:
+                future.set_result(text)
+
+    async def _run_chunk(self, items: List[BodyItem]) -> List[Union[str, Exception]]:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, extract_chunk, items)
+        except (BrokenProcessPool, OSError) as e:
+            # A worker died (or couldn't be spawned); start a fresh pool next time
+            print(f"Extract pool unavailable, extracting inline: {e}")
+            self.shutdown(wait=False)
+            return extract_chunk(items)
+
+    def shutdown(self, wait: bool = True):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+extract_pool = ExtractPool()
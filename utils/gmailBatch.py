@@ -0,0 +1,275 @@
+import asyncio
+import json
+import os
+import uuid
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from utils.backoff import backoff_delay
+from utils.gmailClient import GmailClient, gmail_client
+from utils.messageCache import MessageCache, message_cache
+
+GMAIL_BATCH_URL = "https://www.googleapis.com/batch/gmail/v1"
+GMAIL_MESSAGES_PATH = "/gmail/v1/users/me/messages"
+
+# Google recommends at most 50 Gmail calls per batch; larger ones draw 429 parts
+GMAIL_BATCH_SIZE = min(int(os.getenv("GMAIL_BATCH_SIZE", "50")), 100)
+GMAIL_BATCH_WINDOW = float(os.getenv("GMAIL_BATCH_WINDOW", "0.01"))
+GMAIL_BATCH_MAX_ATTEMPTS = int(os.getenv("GMAIL_BATCH_MAX_ATTEMPTS", "5"))
+GMAIL_BATCH_RETRY_BASE = float(os.getenv("GMAIL_BATCH_RETRY_BASE", "0.5"))  # Seconds
+GMAIL_BATCH_RETRY_MAX = float(os.getenv("GMAIL_BATCH_RETRY_MAX", "8"))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Gmail also reports per-user rate limits as 403 with one of these reasons
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+def build_batch_body(items: List[Tuple[str, str]], boundary: str) -> bytes:
+    """Encode (content_id, request_path) pairs as a multipart/mixed batch body."""
+    lines = []
+    for content_id, path in items:
+        lines.extend(
+            [
+                f"--{boundary}",
+                "Content-Type: application/http",
+                f"Content-ID: <{content_id}>",
+                "",
+                f"GET {path}",
+                "",
+            ]
+        )
+    lines.append(f"--{boundary}--")
+    return "\r\n".join(lines).encode("utf-8")
+
+
+def get_boundary(content_type: str) -> Optional[str]:
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary":
+            return value.strip('"')
+    return None
+
+
+def split_multipart(body: bytes, boundary: str) -> List[Tuple[Dict[str, str], bytes]]:
+    """Split a multipart body into (headers, content) tuples."""
+    parts = []
+    delimiter = f"--{boundary}".encode("utf-8")
+    for chunk in body.split(delimiter)[1:]:
+        if chunk.startswith(b"--"):
+            break  # Closing delimiter
+        headers, content = split_head(chunk.lstrip(b"\r\n"))
+        parts.append((headers, content))
+    return parts
+
+
+def split_head(block: bytes) -> Tuple[Dict[str, str], bytes]:
+    """Split a header block from its content, tolerating bare LF line endings."""
+    block = block.replace(b"\r\n", b"\n")
+    head, _, content = block.partition(b"\n\n")
+    headers = {}
+    for line in head.decode("utf-8", errors="replace").split("\n"):
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers, content.rstrip(b"\n")
+
+
+def parse_batch_response(
+    content_type: str, body: bytes
+) -> Dict[str, Tuple[int, Optional[dict]]]:
+    """Map each part's Content-ID (without the "response-" prefix) to its
+    status code and decoded JSON body."""
+    boundary = get_boundary(content_type)
+    if not boundary:
+        raise ValueError(f"Batch response has no boundary: {content_type}")
+
+    results = {}
+    for headers, content in split_multipart(body, boundary):
+        content_id = headers.get("content-id", "").strip("<>")
+        if content_id.startswith("response-"):
+            content_id = content_id[len("response-") :]
+
+        status_line, _, http_message = content.replace(b"\r\n", b"\n").partition(b"\n")
+        status_parts = status_line.decode("utf-8", errors="replace").split(" ")
+        status_code = int(status_parts[1]) if len(status_parts) > 1 else 500
+        _, http_body = split_head(http_message)
+
+        try:
+            data = json.loads(http_body) if http_body.strip() else None
+        except json.JSONDecodeError:
+            data = None
+        results[content_id] = (status_code, data)
+    return results
+
+
+def is_retryable(status_code: int, data: Optional[dict]) -> bool:
+    if status_code in RETRYABLE_STATUSES:
+        return True
+    if status_code == 403 and isinstance(data, dict):
+        errors = (data.get("error") or {}).get("errors") or []
+        return any(e.get("reason") in RATE_LIMIT_REASONS for e in errors)
+    return False
+
+
+class GmailBatcher:
+    """
+    Coalesces individual messages.get calls into Gmail batch requests.
+
+    Callers await `get_message` for one message at a time; calls for the same
+    access token and query parameters that arrive within GMAIL_BATCH_WINDOW are
+    packed (up to GMAIL_BATCH_SIZE) into a single multipart/mixed request and
+    each caller receives its own part of the response.
+
+    Parts Gmail answers with 429, 5xx or a rate-limit 403 (and whole batches
+    that fail that way) are sent again in a new batch after a jittered
+    backoff, up to GMAIL_BATCH_MAX_ATTEMPTS times.
+
+    Calls made with a `user_key` are answered from the local message cache
+    when possible, and successful fetches are stored there.
+    """
+
+    def __init__(
+        self,
+        client: GmailClient = gmail_client,
+        max_batch: int = GMAIL_BATCH_SIZE,
+        window: float = GMAIL_BATCH_WINDOW,
+        cache: Optional[MessageCache] = message_cache,
+    ):
+        self.client = client
+        self.cache = cache if cache is not None and cache.enabled else None
+        self.max_batch = max_batch
+        self.window = window
+        self._pending: Dict[tuple, list] = {}  # {batch_key: [(msg_id, future)]}
+        self._timers: Dict[tuple, asyncio.TimerHandle] = {}
+        self._batches = set()  # In-flight batch tasks, referenced until they finish
+
+    async def get_message(
+        self,
+        access_token: str,
+        msg_id: str,
+        params: Optional[dict] = None,
+        user_key: Optional[str] = None,
+    ) -> Optional[dict]:
+        """Fetch one message through the batch endpoint. Returns None when
+        Gmail answers the sub-request with a non-200 status that retrying
+        didn't clear."""
+        query = urlencode(params or {}, doseq=True)
+
+        cache_key = None
+        if self.cache is not None and user_key is not None:
+            cache_key = self.cache.key(user_key, msg_id, query)
+            cached = await self.cache.get(user_key, cache_key)
+            if cached is not None:
+                return cached
+
+        batch_key = (access_token, user_key, query)
+        future = asyncio.get_running_loop().create_future()
+
+        pending = self._pending.setdefault(batch_key, [])
+        pending.append((msg_id, future))
+
+        if len(pending) >= self.max_batch:
+            self._flush(batch_key)
+        elif batch_key not in self._timers:
+            self._timers[batch_key] = asyncio.get_running_loop().call_later(
+                self.window, self._flush, batch_key
+            )
+
+        message = await future
+        if message is not None and cache_key is not None:
+            await self.cache.put(user_key, cache_key, message)
+        return message
+
+    async def fetch_messages(
+        self,
+        access_token: str,
+        message_ids: List[str],
+        params: Optional[dict] = None,
+        user_key: Optional[str] = None,
+    ) -> Dict[str, Optional[dict]]:
+        """Fetch many messages, returning {message_id: message or None}."""
+        results = await asyncio.gather(
+            *(
+                self.get_message(access_token, msg_id, params, user_key)
+                for msg_id in message_ids
+            ),
+            return_exceptions=True,
+        )
+        return {
+            msg_id: None if isinstance(result, Exception) else result
+            for msg_id, result in zip(message_ids, results)
+        }
+
+    def _flush(self, batch_key: tuple):
+        timer = self._timers.pop(batch_key, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(batch_key, [])
+        if items:
+            task = asyncio.ensure_future(self._send_batch(batch_key, items))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _send_batch(self, batch_key: tuple, items: list):
+        for attempt in range(1, GMAIL_BATCH_MAX_ATTEMPTS + 1):
+            final = attempt == GMAIL_BATCH_MAX_ATTEMPTS
+            items = await self._send_once(batch_key, items, final)
+            if not items:
+                return
+            delay = backoff_delay(
+                attempt, GMAIL_BATCH_RETRY_BASE, GMAIL_BATCH_RETRY_MAX
+            )
+            print(f"Retrying {len(items)} Gmail batch parts in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def _send_once(self, batch_key: tuple, items: list, final: bool) -> list:
+        """Send `items` as one batch and resolve their futures. Returns the
+        items to retry (none when `final`)."""
+        access_token, user_key, query = batch_key
+        boundary = f"batch_{uuid.uuid4().hex}"
+        requests = []
+        for index, (msg_id, _) in enumerate(items):
+            path = f"{GMAIL_MESSAGES_PATH}/{msg_id}"
+            if query:
+                path = f"{path}?{query}"
+            requests.append((f"item{index}", path))
+
+        try:
+            response = await self.client.post(
+                GMAIL_BATCH_URL,
+                access_token,
+                content=build_batch_body(requests, boundary),
+                headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+                user_key=user_key,
+            )
+            if response.status_code in RETRYABLE_STATUSES and not final:
+                return items
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f"Gmail batch failed ({response.status_code}): {response.text}"
+                )
+            parts = parse_batch_response(
+                response.headers.get("content-type", ""), response.content
+            )
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return []
+
+        retry = []
+        for index, (msg_id, future) in enumerate(items):
+            if future.done():
+                continue
+            status_code, data = parts.get(f"item{index}", (500, None))
+            if status_code != 200:
+                if not final and is_retryable(status_code, data):
+                    retry.append((msg_id, future))
+                    continue
+                print(f"Error fetching message {msg_id} in batch: {status_code}")
+                data = None
+            future.set_result(data)
+        return retry
+
+
+gmail_batcher = GmailBatcher()
@@ -0,0 +1,101 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GMAIL_MAX_CONNECTIONS = int(os.getenv("GMAIL_MAX_CONNECTIONS", "100"))
+GMAIL_MAX_KEEPALIVE = int(os.getenv("GMAIL_MAX_KEEPALIVE", "20"))
+GMAIL_USER_CONCURRENCY = int(os.getenv("GMAIL_USER_CONCURRENCY", "10"))
+GMAIL_TIMEOUT = float(os.getenv("GMAIL_TIMEOUT", "15"))
+
+
+class GmailClient:
+    """
+    Shared async HTTP client for the Gmail API.
+
+    One pooled HTTP/2 connection set is shared by every request on the worker,
+    and each user (keyed by access token unless told otherwise) gets its own
+    semaphore so a single large mailbox cannot take over the whole pool.
+    """
+
+    def __init__(
+        self,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        user_concurrency: int = GMAIL_USER_CONCURRENCY,
+    ):
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self.user_concurrency = user_concurrency
+        self._user_limits: Dict[str, list] = {}  # {user_key: [Semaphore, refcount]}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=GMAIL_MAX_CONNECTIONS,
+                    max_keepalive_connections=GMAIL_MAX_KEEPALIVE,
+                ),
+                timeout=GMAIL_TIMEOUT,
+                transport=self._transport,
+            )
+        return self._client
+
+    async def set_transport(self, transport: Optional[httpx.AsyncBaseTransport]):
+        """Swap the underlying transport (e.g. for the offline Gmail fake)."""
+        await self.aclose()
+        self._transport = transport
+
+    @asynccontextmanager
+    async def user_slot(self, user_key: str):
+        """Hold one of the user's concurrency slots for the duration of a call."""
+        entry = self._user_limits.get(user_key)
+        if entry is None:
+            entry = [asyncio.Semaphore(self.user_concurrency), 0]
+            self._user_limits[user_key] = entry
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._user_limits.pop(user_key, None)
+
+    async def get(
+        self,
+        url: str,
+        access_token: str,
+        params: Optional[dict] = None,
+        user_key: Optional[str] = None,
+    ) -> httpx.Response:
+        headers = {"Authorization": f"Bearer {access_token}"}
+        async with self.user_slot(user_key or access_token):
+            return await self.client.get(url, headers=headers, params=params)
+
+    async def post(
+        self,
+        url: str,
+        access_token: str,
+        content: bytes,
+        headers: Optional[dict] = None,
+        user_key: Optional[str] = None,
+    ) -> httpx.Response:
+        request_headers = {"Authorization": f"Bearer {access_token}"}
+        request_headers.update(headers or {})
+        async with self.user_slot(user_key or access_token):
+            return await self.client.post(url, headers=request_headers, content=content)
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+
+gmail_client = GmailClient()
@@ -0,0 +1,178 @@
+import os
+import re
+import unicodedata
+from html.parser import HTMLParser
+from functools import lru_cache
+from typing import Callable, Dict
+
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HTML_EXTRACT_BACKEND = os.getenv("HTML_EXTRACT_BACKEND", "lxml")
+
+# Non-breaking space, zero width space/non-joiner/joiner, zero width no-break space
+UNWANTED_CHARS_RE = re.compile("[\u00A0\u200B\u200C\u200D\uFEFF]")
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Elements whose text never reaches the reader
+SKIPPED_TAGS = {"script", "style", "head", "noscript", "template", "svg"}
+# Elements without an end tag; they must not be pushed on the open-tag stack
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}  # fmt: skip
+# Elements that start a new line of text when rendered
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt",
+    "footer", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main",
+    "nav", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul",
+}  # fmt: skip
+HIDDEN_STYLE_RE = re.compile(r"display\s*:\s*none|visibility\s*:\s*hidden", re.I)
+# lxml refuses str input that declares its own encoding (common in XHTML mail)
+XML_DECLARATION_RE = re.compile(r"^\s*<\?xml[^>]*\?>", re.I)
+
+
+def clean_text(text: str) -> str:
+    """Normalize and remove unwanted invisible/whitespace characters."""
+    # Normalize Unicode characters (this can help convert compatibility characters)
+    text = unicodedata.normalize("NFKC", text)
+
+    # Replace each unwanted character with a normal space
+    text = UNWANTED_CHARS_RE.sub(" ", text)
+
+    # Collapse multiple whitespace characters into a single space and strip leading/trailing spaces
+    return WHITESPACE_RE.sub(" ", text).strip()
+
+
+def is_hidden(attrs) -> bool:
+    for name, value in attrs:
+        if name == "hidden":
+            return True
+        if name == "style" and value and HIDDEN_STYLE_RE.search(value):
+            return True
+    return False
+
+
+def extract_bs4(html: str) -> str:
+    """The original extraction: every text node of an html.parser tree."""
+    return BeautifulSoup(html, "html.parser").get_text()
+
+
+def extract_lxml(html: str) -> str:
+    """
+    Parse with lxml and drop script/style/hidden elements before reading text.
+    A body with nothing but comments or whitespace has no text; any other
+    lxml failure falls back to the stream backend.
+    """
+    import lxml.etree
+    import lxml.html
+
+    html = XML_DECLARATION_RE.sub("", html, count=1)
+    if not html.strip():
+        return ""
+    try:
+        document = lxml.html.document_fromstring(html)
+    except lxml.etree.ParserError:
+        return ""  # "Document is empty"
+    except (ValueError, lxml.etree.LxmlError) as error:
+        print(f"lxml could not parse the email body, using the stream backend: {error}")
+        return extract_stream(html)
+
+    for element in list(document.iter(*SKIPPED_TAGS)):
+        element.drop_tree()
+    for element in document.xpath("//*[@hidden or @style]"):
+        if element.get("hidden") is not None or HIDDEN_STYLE_RE.search(
+            element.get("style", "")
+        ):
+            element.drop_tree()
+    for element in document.iter(*BLOCK_TAGS):
+        element.tail = f"\n{element.tail or ''}"
+    return document.text_content()
+
+
+class TextTokenizer(HTMLParser):
+    """
+    Single-pass tokenizer that collects visible text without building a tree.
+    Text inside script/style/head and hidden elements is skipped.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self.stack = []  # [(tag, skipped)]
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.chunks.append("\n")
+        if tag in VOID_TAGS:
+            return
+        skipped = tag in SKIPPED_TAGS or is_hidden(attrs)
+        self.stack.append((tag, skipped))
+        if skipped:
+            self.skip_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.chunks.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in BLOCK_TAGS:
+            self.chunks.append("\n")
+        # Pop up to the matching open tag; unclosed children close with it
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                for _, skipped in self.stack[index:]:
+                    if skipped:
+                        self.skip_depth -= 1
+                del self.stack[index:]
+                break
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.chunks.append(data)
+
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+
+def extract_stream(html: str) -> str:
+    tokenizer = TextTokenizer()
+    tokenizer.feed(html)
+    tokenizer.close()
+    return tokenizer.text()
+
+
+EXTRACTORS: Dict[str, Callable[[str], str]] = {
+    "bs4": extract_bs4,
+    "lxml": extract_lxml,
+    "stream": extract_stream,
+}
+
+
+@lru_cache(maxsize=None)
+def lxml_available() -> bool:
+    try:
+        import lxml.html  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_extractor(name: str = None) -> Callable[[str], str]:
+    name = name or HTML_EXTRACT_BACKEND
+    if name not in EXTRACTORS:
+        raise ValueError(
+            f"Unknown HTML extract backend '{name}'. Options: {', '.join(EXTRACTORS)}"
+        )
+    if name == "lxml" and not lxml_available():
+        print("lxml is not installed, using the stream HTML extract backend")
+        return EXTRACTORS["stream"]
+    return EXTRACTORS[name]
+
+
+def html_to_text(html: str, backend: str = None) -> str:
+    """Convert an HTML body to cleaned plain text with the configured backend."""
+    return clean_text(get_extractor(backend)(html))
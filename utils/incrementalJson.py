@@ -0,0 +1,72 @@
+import json
+from typing import Any, List, Tuple
+
+
+class IncrementalObjectParser:
+    """
+    Parses a JSON object that arrives in pieces and returns each top-level
+    member as soon as its value is complete, e.g. one episode topic at a
+    time while the model is still writing the next.
+
+    Only string, escape and nesting state is tracked while scanning, and
+    each character is scanned once. A completed member is parsed with
+    json.loads, so malformed members raise json.JSONDecodeError.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0  # Next character to scan
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.member_start = None  # Buffer index where the current member begins
+        self.done = False
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """Add `text`; return the (key, value) members it completed, in order."""
+        if self.done:
+            return []
+        self.buffer += text
+        members = []
+        buffer = self.buffer
+
+        for i in range(self.position, len(buffer)):
+            char = buffer[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.member_start is None:
+                    self.member_start = i
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.close_member(i, members)
+                    self.done = True
+                    break  # Anything after the object is ignored
+            elif char == "," and self.depth == 1:
+                self.close_member(i, members)
+
+        # Drop what's been consumed so the buffer only holds the open member
+        start = len(buffer) if self.member_start is None else self.member_start
+        self.buffer = buffer[start:]
+        if self.member_start is not None:
+            self.member_start = 0
+        self.position = len(self.buffer)
+        return members
+
+    def close_member(self, end: int, members: list):
+        if self.member_start is None:
+            return  # Empty object or trailing comma
+        member = json.loads("{" + self.buffer[self.member_start : end] + "}")
+        members.extend(member.items())
+        self.member_start = None
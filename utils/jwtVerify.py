@@ -0,0 +1,261 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import httpx
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from dotenv import load_dotenv
+
+from utils.metrics import metrics
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")  # Legacy HS256 projects
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+# "local" verifies signatures here; "network" asks Supabase Auth every time
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "local")
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CLOCK_LEEWAY = float(os.getenv("AUTH_CLOCK_LEEWAY", "30"))
+# Seconds between Supabase Auth checks of one token for revocation; 0 disables
+AUTH_REVOCATION_INTERVAL = float(os.getenv("AUTH_REVOCATION_INTERVAL", "0"))
+JWKS_TTL = float(os.getenv("JWKS_TTL", "600"))
+SUPPORTED_ALGORITHMS = ("HS256", "ES256", "RS256")
+
+metrics.track_ratio("auth.cache_hit_rate", "auth.cache_hits", "auth.cache_misses")
+
+
+class TokenError(Exception):
+    """The access token is malformed, badly signed, expired or revoked."""
+
+    def __init__(self, message: str, expired: bool = False):
+        super().__init__(message)
+        self.expired = expired
+
+
+class NoLocalKey(TokenError):
+    """No secret or JWKS is configured to verify this token locally."""
+
+
+def b64url_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def b64url_int(value: str) -> int:
+    return int.from_bytes(b64url_decode(value), "big")
+
+
+def public_key_from_jwk(jwk: dict):
+    if jwk.get("kty") == "EC" and jwk.get("crv") == "P-256":
+        return ec.EllipticCurvePublicNumbers(
+            b64url_int(jwk["x"]), b64url_int(jwk["y"]), ec.SECP256R1()
+        ).public_key()
+    if jwk.get("kty") == "RSA":
+        return rsa.RSAPublicNumbers(
+            b64url_int(jwk["e"]), b64url_int(jwk["n"])
+        ).public_key()
+    return None
+
+
+class JwtVerifier:
+    """
+    Verifies Supabase access tokens locally and caches the resolved user ID.
+
+    HS256 tokens are checked against SUPABASE_JWT_SECRET; ES256/RS256 tokens
+    against the project's JWKS, fetched from Supabase Auth and refreshed every
+    JWKS_TTL seconds or when a token names an unknown key. A verified token
+    stays cached until its `exp` (at most AUTH_CACHE_TTL). Supabase Auth is
+    only contacted for revocation checks, every AUTH_REVOCATION_INTERVAL
+    seconds per token when that is enabled, and for tokens there is no local
+    key for (HS256 without SUPABASE_JWT_SECRET, ES256/RS256 without
+    SUPABASE_URL), which it verifies on every request as before.
+    """
+
+    def __init__(
+        self,
+        secret: Optional[str] = SUPABASE_JWT_SECRET,
+        supabase_url: Optional[str] = SUPABASE_URL,
+        audience: str = SUPABASE_JWT_AUDIENCE,
+    ):
+        self.secret = secret.encode("utf-8") if secret else None
+        self.issuer = f"{supabase_url.rstrip('/')}/auth/v1" if supabase_url else None
+        self.audience = audience
+        self.jwks: Dict[str, object] = {}  # {kid: public key}
+        self.jwks_fetched_at = 0.0
+        self.jwks_lock = asyncio.Lock()
+        # {sha256(token): (user_id, cached_until, revocation_checked_at)}
+        self.cache = OrderedDict()
+        if AUTH_VERIFY_MODE == "local" and self.secret is None:
+            print(
+                "SUPABASE_JWT_SECRET is not set; HS256 tokens are verified by "
+                "Supabase Auth on every request"
+            )
+
+    async def fetch_jwks(self):
+        if not self.issuer:
+            raise NoLocalKey("SUPABASE_URL is not set; cannot fetch JWKS")
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(
+                f"{self.issuer}/.well-known/jwks.json",
+                headers={"apikey": SUPABASE_ANON_KEY or ""},
+            )
+        response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get("keys", []):
+            key = public_key_from_jwk(jwk)
+            if key is not None:
+                keys[jwk.get("kid")] = key
+        self.jwks = keys
+        self.jwks_fetched_at = time.monotonic()
+
+    async def get_public_key(self, kid: Optional[str]):
+        stale = time.monotonic() - self.jwks_fetched_at > JWKS_TTL
+        if stale or kid not in self.jwks:
+            async with self.jwks_lock:
+                # Another request may have refreshed the keys while we waited
+                stale = time.monotonic() - self.jwks_fetched_at > JWKS_TTL
+                if stale or kid not in self.jwks:
+                    try:
+                        await self.fetch_jwks()
+                    except TokenError:
+                        raise
+                    except Exception as e:
+                        if not self.jwks:
+                            raise TokenError(f"Could not fetch JWKS: {e}")
+                        print(f"JWKS refresh failed, using cached keys: {e}")
+        key = self.jwks.get(kid)
+        if key is None:
+            raise TokenError(f"Unknown signing key '{kid}'")
+        return key
+
+    async def verify_signature(
+        self, header: dict, signing_input: bytes, signature: bytes
+    ):
+        alg = header.get("alg")
+        if alg == "HS256":
+            if self.secret is None:
+                raise NoLocalKey("SUPABASE_JWT_SECRET is not set; cannot verify HS256")
+            expected = hmac.new(self.secret, signing_input, hashlib.sha256).digest()
+            if not hmac.compare_digest(expected, signature):
+                raise TokenError("Invalid token signature")
+            return
+
+        key = await self.get_public_key(header.get("kid"))
+        try:
+            if alg == "ES256" and isinstance(key, ec.EllipticCurvePublicKey):
+                if len(signature) != 64:
+                    raise TokenError("Invalid token signature")
+                der = encode_dss_signature(
+                    int.from_bytes(signature[:32], "big"),
+                    int.from_bytes(signature[32:], "big"),
+                )
+                key.verify(der, signing_input, ec.ECDSA(hashes.SHA256()))
+            elif alg == "RS256" and isinstance(key, rsa.RSAPublicKey):
+                key.verify(
+                    signature, signing_input, padding.PKCS1v15(), hashes.SHA256()
+                )
+            else:
+                raise TokenError(f"Unsupported token algorithm '{alg}'")
+        except InvalidSignature:
+            raise TokenError("Invalid token signature")
+
+    def check_claims(self, claims: dict, now: float):
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            raise TokenError("Token has no expiry")
+        if now > exp + AUTH_CLOCK_LEEWAY:
+            raise TokenError("Token has expired. Please refresh.", expired=True)
+        if claims.get("nbf", 0) > now + AUTH_CLOCK_LEEWAY:
+            raise TokenError("Token is not valid yet")
+
+        audience = claims.get("aud")
+        audiences = audience if isinstance(audience, list) else [audience]
+        if self.audience and self.audience not in audiences:
+            raise TokenError("Token audience is not accepted")
+        if self.issuer and claims.get("iss") != self.issuer:
+            raise TokenError("Token issuer is not accepted")
+        if not claims.get("sub"):
+            raise TokenError("Token has no subject")
+
+    async def decode(self, token: str) -> dict:
+        """Verify `token` and return its claims."""
+        try:
+            encoded_header, encoded_claims, encoded_signature = token.split(".")
+            header = json.loads(b64url_decode(encoded_header))
+            claims = json.loads(b64url_decode(encoded_claims))
+            signature = b64url_decode(encoded_signature)
+        except (ValueError, TypeError):
+            raise TokenError("Malformed access token")
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise TokenError("Malformed access token")
+        if header.get("alg") not in SUPPORTED_ALGORITHMS:
+            raise TokenError(f"Unsupported token algorithm '{header.get('alg')}'")
+
+        signing_input = f"{encoded_header}.{encoded_claims}".encode("ascii")
+        await self.verify_signature(header, signing_input, signature)
+        self.check_claims(claims, time.time())
+        return claims
+
+    async def fetch_remote_user_id(self, token: str) -> str:
+        """Ask Supabase Auth about `token`; it knows about sign-outs and bans."""
+        from utils.supabaseUtils import supabase_func_instance
+
+        metrics.incr("auth.remote_checks")
+        response = await supabase_func_instance.getUserId(accessToken=token)
+        if response.get("status") != "verified":
+            raise TokenError(
+                response.get("message", "Token was revoked"),
+                expired=response.get("error") == "token_expired",
+            )
+        return response["UserID"]
+
+    async def get_user_id(self, token: str) -> str:
+        """Return the user ID (`sub`) of a valid access token, or raise TokenError."""
+        if AUTH_VERIFY_MODE == "network":
+            return await self.fetch_remote_user_id(token)
+
+        cache_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        now = time.time()
+        cached = self.cache.get(cache_key)
+        if cached is not None and cached[1] > now:
+            metrics.incr("auth.cache_hits")
+            self.cache.move_to_end(cache_key)
+            user_id, cached_until, checked_at = cached
+        else:
+            metrics.incr("auth.cache_misses")
+            try:
+                claims = await self.decode(token)
+            except NoLocalKey:
+                metrics.incr("auth.network_fallbacks")
+                return await self.fetch_remote_user_id(token)
+            user_id = claims["sub"]
+            cached_until = min(claims["exp"], now + AUTH_CACHE_TTL)
+            checked_at = 0.0
+
+        if AUTH_REVOCATION_INTERVAL and now - checked_at > AUTH_REVOCATION_INTERVAL:
+            try:
+                await self.fetch_remote_user_id(token)
+            except TokenError:
+                self.cache.pop(cache_key, None)
+                raise
+            checked_at = now
+
+        self.cache[cache_key] = (user_id, cached_until, checked_at)
+        self.cache.move_to_end(cache_key)
+        while len(self.cache) > AUTH_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return user_id
+
+
+jwt_verifier = JwtVerifier()
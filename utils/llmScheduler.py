@@ -0,0 +1,313 @@
+import asyncio
+import email.utils
+import heapq
+import itertools
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import openai
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from utils.backoff import backoff_delay
+from utils.metrics import metrics
+from utils.tokenCount import token_counter
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Per-model limits as JSON, e.g. {"gpt-4o": {"rpm": 500, "tpm": 30000}};
+# models not listed use LLM_DEFAULT_RPM / LLM_DEFAULT_TPM
+LLM_LIMITS = json.loads(os.getenv("LLM_LIMITS", "{}"))
+LLM_DEFAULT_RPM = int(os.getenv("LLM_DEFAULT_RPM", "500"))
+LLM_DEFAULT_TPM = int(os.getenv("LLM_DEFAULT_TPM", "30000"))
+# Output tokens reserved per call when it doesn't set max_tokens
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "1000"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "5"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "1"))  # Seconds
+LLM_RETRY_MAX = float(os.getenv("LLM_RETRY_MAX", "30"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+
+# OpenAI's tier-1 limits for the models we call
+DEFAULT_LIMITS = {
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+}
+
+# Lower runs first: a user waits on their episode, nobody waits on one refine.
+# Priorities only order calls to the same model; with episodes on gpt-4o and
+# refines on gpt-4o-mini they never share a queue, and since OpenAI's limits
+# are per model a refine backlog can't delay an episode anyway.
+PRIORITY_EPISODE = 0
+PRIORITY_REFINE = 1
+
+# Chat formatting overhead per message, on top of its content
+TOKENS_PER_MESSAGE = 4
+
+
+class TokenBucket:
+    """`per_minute` units refilled continuously, holding at most a minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until `amount` units are available."""
+        self.refill()
+        # A request bigger than the bucket waits for a full bucket instead
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float):
+        self.refill()
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self.refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ModelQueue:
+    """
+    Requests waiting for one model's rate limits, released strictly by
+    priority then arrival. Priority never reorders calls across models. A
+    call leaves the queue once both its request and its token reservation
+    fit the buckets and no retry-after pause is active.
+    """
+
+    def __init__(self, model: str, rpm: int, tpm: int):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.waiting: List[tuple] = []  # heap of (priority, seq, tokens, future)
+        self.sequence = itertools.count()
+        self.paused_until = 0.0
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    async def acquire(self, priority: int, tokens: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.sequence), tokens, future))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.dispatch())
+        self.wakeup.set()  # The new request may go first
+        await future
+
+    async def dispatch(self):
+        while self.waiting:
+            _, _, tokens, future = self.waiting[0]
+            if future.done():
+                heapq.heappop(self.waiting)  # Caller gave up waiting
+                continue
+
+            delay = max(
+                self.paused_until - time.monotonic(),
+                self.requests.delay(1),
+                self.tokens.delay(tokens),
+            )
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.waiting)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            future.set_result(None)
+
+    def pause(self, seconds: float):
+        """Hold every request for this model, e.g. for a 429's retry-after."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.wakeup.set()
+
+    def settle(self, reserved: int, used: int):
+        """Correct the token bucket once the real usage of a call is known."""
+        if used < reserved:
+            self.tokens.give_back(reserved - used)
+            self.wakeup.set()
+        else:
+            self.tokens.take(used - reserved)
+
+
+def retry_after(response: Optional[httpx.Response]) -> Optional[float]:
+    """Seconds the server asked us to wait, from retry-after(-ms) headers."""
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                date = email.utils.parsedate_to_datetime(value)
+                return max(0.0, date.timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class LLMScheduler:
+    """
+    Single entry point for OpenAI chat completions.
+
+    Each model has a requests-per-minute and a tokens-per-minute bucket. A
+    call reserves its prompt tokens, counted before sending, plus its
+    max_tokens or LLM_COMPLETION_TOKENS. It waits in that model's priority
+    queue until both buckets allow it; calls to different models never wait
+    on each other. The reservation is corrected from the usage the API
+    reports. A 429 pauses the model's queue for the retry-after the API
+    sends, then the call is retried. Connection errors and 5xx are retried
+    with backoff. The OpenAI client's own retries are disabled so that these
+    retries are the only ones. Cached prompt tokens are recorded per model
+    as llm.<model>.prefix_hit_rate.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, dict]] = None):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.queues: Dict[str, ModelQueue] = {}
+        self._transport: Optional[httpx.AsyncBaseTransport] = None
+        self._client: Optional[AsyncOpenAI] = None
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            http_client = None
+            if self._transport is not None:
+                http_client = httpx.AsyncClient(transport=self._transport)
+            self._client = AsyncOpenAI(
+                api_key=OPENAI_API_KEY or "unset",
+                max_retries=0,
+                timeout=LLM_TIMEOUT,
+                http_client=http_client,
+            )
+        return self._client
+
+    async def set_transport(self, transport: Optional[httpx.AsyncBaseTransport]):
+        """Swap the underlying transport (e.g. for the offline OpenAI fake)."""
+        await self.aclose()
+        self._transport = transport
+
+    def queue(self, model: str) -> ModelQueue:
+        queue = self.queues.get(model)
+        if queue is None:
+            limits = self.limits.get(model, {})
+            queue = ModelQueue(
+                model,
+                limits.get("rpm", LLM_DEFAULT_RPM),
+                limits.get("tpm", LLM_DEFAULT_TPM),
+            )
+            self.queues[model] = queue
+        return queue
+
+    async def prompt_tokens(self, model: str, messages: List[dict]) -> int:
+        contents = [m.get("content") or "" for m in messages]
+        counts = await token_counter.count_batch(contents, model)
+        return sum(counts) + TOKENS_PER_MESSAGE * len(messages)
+
+    async def create(self, priority: int = PRIORITY_REFINE, **kwargs):
+        """
+        `client.chat.completions.create(**kwargs)`, scheduled and retried.
+        With stream=True an async iterator over the chunks is returned; the
+        usage chunk is requested so the call is accounted like the others.
+        """
+        model = kwargs["model"]
+        if kwargs.get("stream"):
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        queue = self.queue(model)
+        prompt_tokens = await self.prompt_tokens(model, kwargs["messages"])
+        reserved = prompt_tokens + (kwargs.get("max_tokens") or LLM_COMPLETION_TOKENS)
+        metrics.observe(f"llm.{model}.prompt_tokens", prompt_tokens)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            queued_at = time.perf_counter()
+            await queue.acquire(priority, reserved)
+            metrics.observe(
+                f"llm.{model}.queue_wait_ms", (time.perf_counter() - queued_at) * 1000
+            )
+
+            try:
+                response = await self.client.chat.completions.create(**kwargs)
+            except openai.RateLimitError as e:
+                metrics.incr(f"llm.{model}.rate_limited")
+                if e.code == "insufficient_quota" or attempt >= LLM_MAX_ATTEMPTS:
+                    raise
+                delay = retry_after(e.response)
+                if delay is None:
+                    delay = backoff_delay(attempt, LLM_RETRY_BASE, LLM_RETRY_MAX)
+                queue.settle(reserved, 0)  # Rejected calls use no tokens
+                queue.pause(delay)
+                print(f"⏳ {model} rate limited, retrying after {delay:.2f}s")
+                continue
+            except (
+                openai.APIConnectionError,  # Includes timeouts
+                openai.InternalServerError,
+            ) as e:
+                metrics.incr(f"llm.{model}.retries")
+                if attempt >= LLM_MAX_ATTEMPTS:
+                    raise
+                queue.settle(reserved, 0)
+                print(f"Retrying {model} call after error: {e}")
+                await asyncio.sleep(
+                    backoff_delay(attempt, LLM_RETRY_BASE, LLM_RETRY_MAX)
+                )
+                continue
+
+            metrics.incr(f"llm.{model}.calls")
+            if kwargs.get("stream"):
+                return self.stream_chunks(response, queue, reserved)
+            self.record_usage(queue, reserved, response.usage)
+            return response
+
+    async def stream_chunks(self, stream, queue: ModelQueue, reserved: int):
+        async for chunk in stream:
+            if chunk.usage is not None:
+                self.record_usage(queue, reserved, chunk.usage)
+            yield chunk
+
+    def record_usage(self, queue: ModelQueue, reserved: int, usage):
+        """Settle the call's token reservation and record how much of its
+        prompt was served from OpenAI's prompt cache."""
+        if usage is None:
+            return
+        queue.settle(reserved, usage.total_tokens)
+
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        model = queue.model
+        metrics.observe(f"llm.{model}.cached_tokens", cached)
+        metrics.incr(f"llm.{model}.prompt_tokens_cached", cached)
+        metrics.incr(
+            f"llm.{model}.prompt_tokens_uncached", usage.prompt_tokens - cached
+        )
+        metrics.track_ratio(
+            f"llm.{model}.prefix_hit_rate",
+            f"llm.{model}.prompt_tokens_cached",
+            f"llm.{model}.prompt_tokens_uncached",
+        )
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+llm_scheduler = LLMScheduler(LLM_LIMITS)
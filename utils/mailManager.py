@@ -4,6 +4,7 @@ class MailManager:
         self.webhook = {}
         self.bgTask = {}
         self.killOwner = {}
+        self.pendingReductions = {}  # Failures seen before the mail count is known
 
     def set_kill_owner(self, userID):
         self.killOwner[userID] = True
@@ -16,7 +17,7 @@ class MailManager:
             del self.killOwner[userID]
 
     def set_user_mails(self, userID, mailCount):
-        self.mails[userID] = mailCount
+        self.mails[userID] = mailCount - self.pendingReductions.pop(userID, 0)
 
     # def set_user_hook(self, userID, Count):
     #     self.mails[userID] = Count
@@ -36,6 +37,8 @@ class MailManager:
     def delete_user_mail(self, userID):
         if userID in self.mails:
             del self.mails[userID]
+        # Failures from an earlier import must not count against the next one
+        self.pendingReductions.pop(userID, None)
 
     def get_user_mails(self, userID):
         return self.mails.get(userID)
@@ -46,10 +49,16 @@ class MailManager:
     def reduce_user_mail(self, userID):
         if userID in self.mails:
             self.mails[userID] -= 1
+        else:
+            # Emails are saved while they stream in, so a refine can fail
+            # before send_selected knows the final count
+            self.pendingReductions[userID] = self.pendingReductions.get(userID, 0) + 1
 
     def delete_user_mail(self, userID):
         if userID in self.mails:
             del self.mails[userID]
+        # Failures from an earlier import must not count against the next one
+        self.pendingReductions.pop(userID, None)
 
     def delete_user_hook(self, userID):
         if userID in self.webhook:
@@ -63,6 +72,8 @@ class MailManager:
         if userID in self.mails:
             del self.mails[userID]
 
+        self.pendingReductions.pop(userID, None)
+
     def update_webhook_count(self, userID):
         """Check if userID exists in webhook; increment if it does, set to 1 if it doesn't."""
         if userID in self.webhook:
@@ -0,0 +1,268 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from utils.metrics import metrics
+
+load_dotenv()
+
+MESSAGE_CACHE_DIR = os.getenv("MESSAGE_CACHE_DIR", ".cache/messages")
+# 0 disables the cache
+MESSAGE_CACHE_MAX_BYTES = int(os.getenv("MESSAGE_CACHE_MAX_BYTES", str(512 << 20)))
+MESSAGE_CACHE_SEGMENT_BYTES = int(
+    os.getenv("MESSAGE_CACHE_SEGMENT_BYTES", str(32 << 20))
+)
+
+# Worker processes each claim a slot directory; past this many the extra
+# workers run without a cache
+MESSAGE_CACHE_SLOTS = int(os.getenv("MESSAGE_CACHE_SLOTS", "16"))
+
+# Record: 32-byte key digest, 4-byte payload length, payload
+RECORD_HEADER = struct.Struct(">32sI")
+SEGMENT_SUFFIX = ".seg"
+SLOT_LOCK = "slot.lock"
+
+metrics.track_ratio(
+    "message_cache.hit_rate", "message_cache.hits", "message_cache.misses"
+)
+
+
+class MessageCache:
+    """
+    Local cache of raw Gmail API messages. Message IDs are immutable, so a
+    message fetched once (in a given format) never needs fetching again.
+
+    Records are appended to segment files; an in-memory index maps each key
+    to (segment, offset, length) and is rebuilt by scanning the segments on
+    startup. Sealed segments are read through mmap. When the cache grows past
+    MESSAGE_CACHE_MAX_BYTES the oldest segment is deleted, and a hit on a
+    record outside the active segment copies it forward, so eviction
+    approximates LRU.
+
+    The index and segment sizes live in this process, so segments can't be
+    shared between processes. Each process takes an exclusive flock on one
+    slot-N directory under MESSAGE_CACHE_DIR and keeps it until close();
+    several uvicorn workers therefore get separate caches, each bounded by
+    MESSAGE_CACHE_MAX_BYTES, and a restarted worker reopens a free slot.
+
+    Keys are hashes of the user, message ID and query, and payloads are
+    compressed then encrypted with a Fernet key derived for that user.
+    """
+
+    def __init__(
+        self,
+        directory: str = MESSAGE_CACHE_DIR,
+        max_bytes: int = MESSAGE_CACHE_MAX_BYTES,
+        segment_bytes: int = MESSAGE_CACHE_SEGMENT_BYTES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.loaded = False
+        # {key: (segment seq, offset, length)}
+        self.index: Dict[bytes, Tuple[int, int, int]] = {}
+        self.segment_keys: Dict[int, Set[bytes]] = {}
+        self.segment_sizes: Dict[int, int] = {}
+        self.maps: Dict[int, mmap.mmap] = {}  # Sealed segments only
+        self.active_seq = 0
+        self.active_file = None
+        self.slot_dir: Optional[str] = None  # None until loaded, or no slot free
+        self.slot_lock = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(user_key: str, message_id: str, query: str = "") -> bytes:
+        return hashlib.sha256(f"{user_key}\0{message_id}\0{query}".encode()).digest()
+
+    @staticmethod
+    def cipher(user_key: str):
+        from utils.encryption import cryption
+
+        return cryption.user_cipher(user_key)
+
+    def segment_path(self, seq: int) -> str:
+        return os.path.join(self.slot_dir, f"{seq:08d}{SEGMENT_SUFFIX}")
+
+    def claim_slot(self) -> Optional[str]:
+        """Lock the first slot directory no other process holds."""
+        for slot in range(MESSAGE_CACHE_SLOTS):
+            path = os.path.join(self.directory, f"slot-{slot}")
+            os.makedirs(path, exist_ok=True)
+            lock_file = open(os.path.join(path, SLOT_LOCK), "a")
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                continue
+            self.slot_lock = lock_file
+            return path
+        return None
+
+    def load(self):
+        """Claim a slot and rebuild the index from its segment files (later
+        records win)."""
+        self.loaded = True
+        self.slot_dir = self.claim_slot()
+        if self.slot_dir is None:
+            print("No free message cache slot, running without the cache")
+            return
+        seqs = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.slot_dir)
+            if name.endswith(SEGMENT_SUFFIX) and name[: -len(SEGMENT_SUFFIX)].isdigit()
+        )
+        for seq in seqs:
+            self.scan_segment(seq)
+        self.active_seq = seqs[-1] if seqs else 1
+        self.open_active()
+
+    def scan_segment(self, seq: int):
+        path = self.segment_path(seq)
+        offset = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                key, length = RECORD_HEADER.unpack(header)
+                start = offset + RECORD_HEADER.size
+                if f.seek(length, os.SEEK_CUR) > os.fstat(f.fileno()).st_size:
+                    break  # Torn write at the tail
+                self.add_to_index(key, seq, start, length)
+                offset = start + length
+        if offset < os.path.getsize(path):
+            os.truncate(path, offset)
+        self.segment_sizes[seq] = offset
+
+    def add_to_index(self, key: bytes, seq: int, offset: int, length: int):
+        previous = self.index.get(key)
+        if previous is not None:
+            self.segment_keys.get(previous[0], set()).discard(key)
+        self.index[key] = (seq, offset, length)
+        self.segment_keys.setdefault(seq, set()).add(key)
+
+    def open_active(self):
+        self.active_file = open(self.segment_path(self.active_seq), "ab")
+        self.segment_sizes.setdefault(self.active_seq, self.active_file.tell())
+
+    def seal_active(self):
+        self.active_file.close()
+        self.active_seq += 1
+        self.open_active()
+
+    def segment_map(self, seq: int) -> mmap.mmap:
+        segment_map = self.maps.get(seq)
+        if segment_map is None:
+            with open(self.segment_path(seq), "rb") as f:
+                segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[seq] = segment_map
+        return segment_map
+
+    def read_record(self, seq: int, offset: int, length: int) -> bytes:
+        if seq == self.active_seq:
+            self.active_file.flush()
+            with open(self.segment_path(seq), "rb") as f:
+                return os.pread(f.fileno(), length, offset)
+        return self.segment_map(seq)[offset : offset + length]
+
+    def append(self, key: bytes, payload: bytes):
+        if self.segment_sizes[self.active_seq] >= self.segment_bytes:
+            self.seal_active()
+        offset = self.segment_sizes[self.active_seq]
+        self.active_file.write(RECORD_HEADER.pack(key, len(payload)) + payload)
+        start = offset + RECORD_HEADER.size
+        self.segment_sizes[self.active_seq] = start + len(payload)
+        self.add_to_index(key, self.active_seq, start, len(payload))
+        self.evict()
+
+    def evict(self):
+        while sum(self.segment_sizes.values()) > self.max_bytes:
+            oldest = min(self.segment_sizes)
+            if oldest == self.active_seq:
+                break
+            segment_map = self.maps.pop(oldest, None)
+            if segment_map is not None:
+                segment_map.close()
+            for key in self.segment_keys.pop(oldest, ()):
+                if self.index.get(key, (None,))[0] == oldest:
+                    del self.index[key]
+            del self.segment_sizes[oldest]
+            os.remove(self.segment_path(oldest))
+
+    def get_sync(self, user_key: str, key: bytes) -> Optional[dict]:
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            if self.slot_dir is None:
+                return None
+            location = self.index.get(key)
+            if location is None:
+                return None
+            token = self.read_record(*location)
+            if location[0] != self.active_seq:
+                self.append(key, token)  # Keep recently used records young
+
+        try:
+            raw = self.cipher(user_key).decrypt(token)
+        except Exception:
+            return None  # Written under a different SECRET_KEY
+        return json.loads(zlib.decompress(raw))
+
+    def put_sync(self, user_key: str, key: bytes, message: dict):
+        raw = zlib.compress(json.dumps(message, separators=(",", ":")).encode())
+        token = self.cipher(user_key).encrypt(raw)
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            if self.slot_dir is None:
+                return
+            self.append(key, token)
+            self.active_file.flush()
+
+    async def get(self, user_key: str, key: bytes) -> Optional[dict]:
+        try:
+            message = await asyncio.to_thread(self.get_sync, user_key, key)
+        except Exception as e:
+            print(f"Message cache read failed: {e}")
+            message = None
+        metrics.incr("message_cache.hits" if message else "message_cache.misses")
+        return message
+
+    async def put(self, user_key: str, key: bytes, message: dict):
+        try:
+            await asyncio.to_thread(self.put_sync, user_key, key, message)
+        except Exception as e:
+            print(f"Message cache write failed: {e}")
+
+    def close(self):
+        with self.lock:
+            for segment_map in self.maps.values():
+                segment_map.close()
+            self.maps.clear()
+            if self.active_file is not None:
+                self.active_file.close()
+                self.active_file = None
+            if self.slot_lock is not None:
+                self.slot_lock.close()  # Releases the flock
+                self.slot_lock = None
+            self.index.clear()
+            self.segment_keys.clear()
+            self.segment_sizes.clear()
+            self.slot_dir = None
+            self.loaded = False
+
+
+message_cache = MessageCache()
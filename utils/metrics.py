@@ -0,0 +1,55 @@
+import time
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    Process-wide counters and observations (latencies, sizes) for the
+    pipeline stages. A snapshot is served at GET /metrics.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.counters = defaultdict(float)
+        self.observations = {}
+        self.ratios = {}  # {name: (hits_counter, misses_counter)}
+
+    def incr(self, name: str, value: float = 1):
+        self.counters[name] += value
+
+    def observe(self, name: str, value: float):
+        stats = self.observations.get(name)
+        if stats is None:
+            stats = {"count": 0, "sum": 0.0, "min": value, "max": value, "last": value}
+            self.observations[name] = stats
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["min"] = min(stats["min"], value)
+        stats["max"] = max(stats["max"], value)
+        stats["last"] = value
+
+    def ratio(self, hits: str, misses: str) -> float:
+        total = self.counters[hits] + self.counters[misses]
+        return self.counters[hits] / total if total else 0.0
+
+    def track_ratio(self, name: str, hits: str, misses: str):
+        """Report `hits / (hits + misses)` under `name` in every snapshot."""
+        self.ratios[name] = (hits, misses)
+
+    def snapshot(self) -> dict:
+        observations = {
+            name: dict(stats, avg=stats["sum"] / stats["count"])
+            for name, stats in self.observations.items()
+        }
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "counters": dict(self.counters),
+            "observations": observations,
+            "ratios": {
+                name: round(self.ratio(hits, misses), 4)
+                for name, (hits, misses) in self.ratios.items()
+            },
+        }
+
+
+metrics = Metrics()
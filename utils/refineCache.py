@@ -0,0 +1,285 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from utils.htmlExtract import clean_text
+from utils.metrics import metrics
+
+load_dotenv()
+
+REFINE_CACHE_BACKEND = os.getenv("REFINE_CACHE_BACKEND", "disk")  # disk | table | none
+REFINE_CACHE_DIR = os.getenv("REFINE_CACHE_DIR", ".cache/refine")
+REFINE_CACHE_TABLE = os.getenv("REFINE_CACHE_TABLE", "refine_cache")
+REFINE_CACHE_MAX_ENTRIES = int(os.getenv("REFINE_CACHE_MAX_ENTRIES", "20000"))
+REFINE_CACHE_TTL = float(os.getenv("REFINE_CACHE_TTL", str(7 * 86400)))
+# Table backend: purge rows unused for REFINE_CACHE_TTL once every N stores
+REFINE_CACHE_PURGE_EVERY = int(os.getenv("REFINE_CACHE_PURGE_EVERY", "500"))
+
+metrics.track_ratio("refine_cache.hit_rate", "refine_cache.hits", "refine_cache.misses")
+
+
+def refine_cache_key(parsed_text: str, model: str, prompt: str) -> str:
+    """
+    Content address of a refinement: the cleaned newsletter text plus the
+    model and prompt template that produced it, so changing either starts a
+    fresh cache instead of serving stale output.
+    """
+    digest = hashlib.sha256()
+    for part in (model, prompt, clean_text(parsed_text)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class DiskRefineBackend:
+    """
+    One JSON file per entry under REFINE_CACHE_DIR. Entries expire
+    REFINE_CACHE_TTL after they were written; beyond REFINE_CACHE_MAX_ENTRIES
+    the least recently used files (by mtime, refreshed on every hit) are
+    removed. Files are replaced atomically so several workers can share the
+    directory.
+    """
+
+    def __init__(
+        self,
+        directory: str = REFINE_CACHE_DIR,
+        max_entries: int = REFINE_CACHE_MAX_ENTRIES,
+        ttl: float = REFINE_CACHE_TTL,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.index: Optional[OrderedDict] = None  # {key: None}, oldest first
+        self.lock = threading.Lock()  # Reads and writes run in worker threads
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def load_index(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    try:
+                        mtime = os.path.getmtime(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    entries.append((mtime, name[: -len(".json")]))
+        entries.sort()
+        self.index = OrderedDict((key, None) for _, key in entries)
+
+    def touch(self, key: str) -> list:
+        """Mark `key` most recently used; returns the keys evicted to make room."""
+        with self.lock:
+            if self.index is None:
+                self.load_index()
+            self.index[key] = None
+            self.index.move_to_end(key)
+            evicted = []
+            while len(self.index) > self.max_entries:
+                evicted.append(self.index.popitem(last=False)[0])
+        return evicted
+
+    def remove(self, key: str):
+        with self.lock:
+            if self.index is not None:
+                self.index.pop(key, None)
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def read(self, key: str) -> Optional[dict]:
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self.remove(key)
+            return None
+
+        if time.time() - entry.get("created_at", 0) > self.ttl:
+            self.remove(key)
+            return None
+        os.utime(path)
+        self.touch(key)
+        return entry
+
+    def write(self, key: str, entry: dict):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+        for old_key in self.touch(key):
+            self.remove(old_key)
+
+    async def get(self, key: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.read, key)
+
+    async def set(self, key: str, entry: dict):
+        await asyncio.to_thread(self.write, key, entry)
+
+
+class TableRefineBackend:
+    """
+    Entries in the Supabase `refine_cache` table (key text primary key,
+    refined_text text, token_count int, created_at float8, last_used float8),
+    shared by every worker. `last_used` is refreshed at most once per tenth
+    of the TTL, and rows unused for REFINE_CACHE_TTL are purged periodically.
+    """
+
+    def __init__(self, table: str = REFINE_CACHE_TABLE, ttl: float = REFINE_CACHE_TTL):
+        self.table = table
+        self.ttl = ttl
+        self.stores = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        from utils.supabaseUtils import supabase_func_instance
+
+        response = (
+            await supabase_func_instance.supabase.table(self.table)
+            .select("refined_text, token_count, created_at, last_used")
+            .eq("key", key)
+            .limit(1)
+            .execute()
+        )
+        if not response.data:
+            return None
+
+        entry = response.data[0]
+        now = time.time()
+        if now - (entry.get("last_used") or 0) > self.ttl:
+            return None
+        if now - entry["last_used"] > self.ttl / 10:
+            await (
+                supabase_func_instance.supabase.table(self.table)
+                .update({"last_used": now})
+                .eq("key", key)
+                .execute()
+            )
+        return entry
+
+    async def set(self, key: str, entry: dict):
+        from utils.supabaseUtils import supabase_func_instance
+
+        now = time.time()
+        await (
+            supabase_func_instance.supabase.table(self.table)
+            .upsert(dict(entry, key=key, last_used=now), on_conflict="key")
+            .execute()
+        )
+
+        self.stores += 1
+        if self.stores % REFINE_CACHE_PURGE_EVERY == 0:
+            await (
+                supabase_func_instance.supabase.table(self.table)
+                .delete()
+                .lt("last_used", now - self.ttl)
+                .execute()
+            )
+
+
+REFINE_CACHE_BACKENDS = {
+    "disk": DiskRefineBackend,
+    "table": TableRefineBackend,
+}
+
+
+class RefineCache:
+    """
+    Content-addressed cache of refined newsletter text.
+
+    Refinement runs at temperature 0 with a fixed prompt, so every copy of the
+    same newsletter refines to the same output regardless of recipient. Cache
+    failures are logged and treated as misses; they never fail a refinement.
+    Concurrent misses for one key in this process share a single LLM call.
+    """
+
+    def __init__(self, backend: str = REFINE_CACHE_BACKEND):
+        if backend not in (*REFINE_CACHE_BACKENDS, "none"):
+            raise ValueError(
+                f"Unknown refine cache backend '{backend}'. "
+                f"Options: {', '.join(REFINE_CACHE_BACKENDS)}, none"
+            )
+        self.backend = REFINE_CACHE_BACKENDS[backend]() if backend != "none" else None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get(self, key: str) -> Optional[dict]:
+        if self.backend is None:
+            return None
+        try:
+            return await self.backend.get(key)
+        except Exception as e:
+            metrics.incr("refine_cache.errors")
+            print(f"Refine cache lookup failed: {e}")
+            return None
+
+    async def set(self, key: str, refined_text: str, token_count: int):
+        if self.backend is None:
+            return
+        entry = {
+            "refined_text": refined_text,
+            "token_count": token_count,
+            "created_at": time.time(),
+        }
+        try:
+            await self.backend.set(key, entry)
+        except Exception as e:
+            metrics.incr("refine_cache.errors")
+            print(f"Refine cache store failed: {e}")
+
+    async def get_or_refine(
+        self,
+        parsed_text: str,
+        model: str,
+        prompt: str,
+        refine: Callable[[], Awaitable[Tuple[str, int]]],
+    ) -> Tuple[str, int]:
+        """Return (refined_text, token_count) from the cache, or from `refine()`
+        which is then stored for the next recipient of the same newsletter."""
+        key = refine_cache_key(parsed_text, model, prompt)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            metrics.incr("refine_cache.hits")
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            entry = await self.get(key)
+            if entry is not None:
+                metrics.incr("refine_cache.hits")
+                metrics.incr("refine_cache.tokens_saved", entry["token_count"] or 0)
+                result = entry["refined_text"], entry["token_count"]
+            else:
+                metrics.incr("refine_cache.misses")
+                result = await refine()
+                await self.set(key, *result)
+            future.set_result(result)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Waiters see the exception; don't warn when nobody was waiting
+                future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        return result
+
+
+refine_cache = RefineCache()
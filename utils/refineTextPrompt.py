@@ -8,6 +8,17 @@ Remove any extraneous elements that do not contribute to the main content of the
 
 Ensure that the final output preserves the original sentence structure, wording, and order, maintaining the integrity of the newsletter’s core content without any unnecessary modifications.
 
-Original Text:  
-{parsed_text}
+The original text is provided in the user message.
 """
+
+
+def refine_messages(parsed_text: str) -> list:
+    """
+    Chat messages for one refine call. The instructions never change, so
+    they form an identical leading prefix that OpenAI can serve from its
+    prompt cache; only the user message differs between calls.
+    """
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": f"Original Text:\n{parsed_text}"},
+    ]
@@ -1,62 +1,146 @@
-async def save_emails_batch(user_id: str, emails: list):
-    """Insert emails into Supabase in batches of 5 while avoiding duplicates."""
+import asyncio
+import os
+import time
+
+import httpx
+from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+
+from utils.backoff import backoff_delay
+from utils.metrics import metrics
+
+load_dotenv()
+
+SAVE_BATCH_SIZE = int(os.getenv("SAVE_BATCH_SIZE", "10"))
+SAVE_CONCURRENCY = int(os.getenv("SAVE_CONCURRENCY", "4"))  # Upserts in flight
+SAVE_MAX_ATTEMPTS = int(os.getenv("SAVE_MAX_ATTEMPTS", "4"))
+SAVE_RETRY_BASE = float(os.getenv("SAVE_RETRY_BASE", "0.25"))  # Seconds
+SAVE_RETRY_MAX = float(os.getenv("SAVE_RETRY_MAX", "4"))
+
+# Postgres / PostgREST codes worth retrying: serialization failure, deadlock,
+# statement timeout, too many connections, connection loss, PostgREST unable
+# to reach the database, and gateway/rate-limit HTTP statuses.
+TRANSIENT_ERROR_CODES = {
+    "40001", "40P01", "57014", "53300", "08000", "08003", "08006",
+    "PGRST000", "PGRST001", "PGRST002",
+    "429", "500", "502", "503", "504",
+}  # fmt: skip
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, APIError):
+        return str(error.code) in TRANSIENT_ERROR_CODES
+    return False
+
+
+async def upsert_batch_with_retry(batch: list, index: int) -> dict:
+    """
+    Upsert one batch, retrying transient failures. Returns a report with the
+    batch index, size, attempts, total latency (including backoff) and status.
+    """
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
+        response = await upsert_emails(batch)
+        if response.get("status") == "success":
+            break
+        if not response.get("retryable") or attempt >= SAVE_MAX_ATTEMPTS:
+            break
+        delay = backoff_delay(attempt, SAVE_RETRY_BASE, SAVE_RETRY_MAX)
+        print(f"Retrying batch {index} in {delay:.2f}s: {response.get('error_details')}")
+        await asyncio.sleep(delay)
+
+    latency_ms = (time.perf_counter() - started) * 1000
+    metrics.observe("save.batch_latency_ms", latency_ms)
+    metrics.incr("save.batch_retries", attempt - 1)
+    report = {
+        "batch": index,
+        "size": len(batch),
+        "attempts": attempt,
+        "latency_ms": round(latency_ms, 1),
+        "status": response.get("status"),
+    }
+    if response.get("status") != "success":
+        report["error"] = response.get("error_details") or response.get("message")
+    return report
+
+
+async def save_emails_stream(
+    user_id: str, emails, batch_size: int = None, concurrency: int = None
+):
+    """
+    Upsert emails into Supabase as they arrive from an async iterable,
+    writing each micro-batch of `batch_size` as soon as it fills so the
+    refine webhooks start while later emails are still being fetched.
+    Up to `concurrency` batches are in flight at once.
+    """
+    batch_size = batch_size or SAVE_BATCH_SIZE
+    semaphore = asyncio.Semaphore(concurrency or SAVE_CONCURRENCY)
 
-    if not emails:
-        return {"status": "error", "message": "No emails provided."}
+    buffer_batch = []
+    total_received = 0
+    tasks = []
+
+    async def upsert(batch: list, index: int):
+        try:
+            return batch, await upsert_batch_with_retry(batch, index)
+        finally:
+            semaphore.release()
+
+    async def flush():
+        # Waits here while `concurrency` batches are in flight, which also
+        # stops reading emails faster than they can be saved
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(upsert(list(buffer_batch), len(tasks))))
+        buffer_batch.clear()
 
-    print("inside the save_emails_batch 1")
+    try:
+        async for email in emails:
+            email["user_id"] = user_id  # Attach user_id
+            buffer_batch.append(email)
+            total_received += 1
 
-    batch_size = 5
-    buffer_batch = []
-    total_inserted = 0
-    failed_batches = []
-    # print(emails)
-    print("Batch count is ", len(emails))
-
-    for email in emails:
-        email["user_id"] = user_id  # Attach user_id
-        buffer_batch.append(email)
-
-        if len(buffer_batch) == batch_size:
-            response = await upsert_emails(buffer_batch)
-            # response = upsert_emails(buffer_batch)
-
-            if response.get("status") == "success":
-                total_inserted += len(buffer_batch)
-                buffer_batch.clear()  # Clear buffer after successful insert
-            else:
-                failed_batches.append(
-                    {"batch": buffer_batch, "error": response.get("error_details")}
-                )
-                buffer_batch.clear()  # Clear buffer even on failure to prevent duplicate inserts
-
-    print("inside the save_emails_batch 2")
-    # Insert any remaining emails
-    if buffer_batch:
-        response = await upsert_emails(buffer_batch)
-        # response = upsert_emails(buffer_batch)
-        print("This is the response on upsert ", response)
+            if len(buffer_batch) == batch_size:
+                await flush()
 
-        if response.get("status") == "success":
-            total_inserted += len(buffer_batch)
-        else:
-            failed_batches.append(
-                {"batch": buffer_batch, "error": response.get("error_details")}
-            )
+        # Insert any remaining emails
+        if buffer_batch:
+            await flush()
+
+        results = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    print("Batch count is ", total_received)
+
+    if not total_received:
+        return {"status": "error", "message": "No emails provided."}
+
+    batches = [report for _, report in results]
+    total_inserted = sum(r["size"] for r in batches if r["status"] == "success")
+    failed_batches = [
+        {"batch": batch, "error": report.get("error")}
+        for batch, report in results
+        if report["status"] != "success"
+    ]
 
     # Return a structured summary
     if failed_batches:
-        print("inside the save_emails_batch 3")
         return {
             "status": "partial_success",
             "message": f"Inserted {total_inserted} emails, but some batches failed.",
             "failed_batches": failed_batches,
+            "batches": batches,
         }
     else:
-
         return {
             "status": "success",
             "message": f"Successfully inserted {total_inserted} emails.",
+            "batches": batches,
         }
 
 
@@ -76,31 +160,18 @@ async def upsert_emails(batch: list):
         # print("This is supabase response:", response)
 
         # Check if response contains 'data'
-        if "data" in response and response["data"]:
+        if response.data:
             print(
                 {
                     "status": "success",
-                    "message": f"✅ {len(response['data'])} records inserted/updated successfully.",
-                    # "data": response["data"],
+                    "message": f"✅ {len(response.data)} records inserted/updated successfully.",
+                    # "data": response.data,
                 }
             )
             return {
                 "status": "success",
-                "message": f"✅ {len(response['data'])} records inserted/updated successfully.",
-                "data": response["data"],
-            }
-        elif "error" in response and response["error"]:
-            print(
-                {
-                    "status": "error",
-                    "message": "Error inserting/updating records.",
-                    # "error_details": response["error"],
-                }
-            )
-            return {
-                "status": "error",
-                "message": "Error inserting/updating records.",
-                # "error_details": response["error"],
+                "message": f"✅ {len(response.data)} records inserted/updated successfully.",
+                "data": response.data,
             }
         else:
             print(
@@ -121,4 +192,5 @@ async def upsert_emails(batch: list):
             "status": "error",
             "message": "Exception occurred while inserting/updating records.",
             "error_details": str(e),
+            "retryable": is_transient(e),
         }
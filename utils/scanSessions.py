@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from typing import AsyncGenerator, AsyncIterator, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCAN_SESSION_TTL = float(os.getenv("SCAN_SESSION_TTL", "300"))
+
+
+class ScanSession:
+    """
+    A sender scan running in the background, with every SSE frame it produced
+    kept in order so a reconnecting client can pick up after the last frame it
+    saw instead of restarting the scan.
+    """
+
+    def __init__(self, owner: str):
+        self.scan_id = uuid.uuid4().hex
+        self.owner = owner  # Hash of the access token that started the scan
+        self.frames = []
+        self.done = False
+        self.touched = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.condition = asyncio.Condition()
+
+    async def run(self, frames: AsyncIterator[str]):
+        """Consume the scan generator, recording each frame."""
+        try:
+            async for frame in frames:
+                async with self.condition:
+                    self.frames.append(frame)
+                    self.condition.notify_all()
+        except Exception as e:
+            print(f"Sender scan {self.scan_id} failed: {e}")
+        finally:
+            async with self.condition:
+                self.done = True
+                self.touched = time.monotonic()
+                self.condition.notify_all()
+
+    async def stream(self, after_seq: int = 0) -> AsyncGenerator[str, None]:
+        """Yield frames after `after_seq`, tagged with resumable event IDs, and
+        keep following the scan until it finishes."""
+        seq = after_seq
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(
+                    lambda: len(self.frames) > seq or self.done
+                )
+                pending = self.frames[seq:]
+                finished = self.done
+            self.touched = time.monotonic()
+
+            for frame in pending:
+                seq += 1
+                yield f"id: {self.scan_id}:{seq}\n{frame}"
+
+            if finished and seq >= len(self.frames):
+                break
+
+
+class ScanSessionManager:
+    """Short-lived, in-process registry of sender scans keyed by scan ID."""
+
+    def __init__(self, ttl: float = SCAN_SESSION_TTL):
+        self.ttl = ttl
+        self.sessions: Dict[str, ScanSession] = {}
+
+    @staticmethod
+    def owner_key(access_token: str) -> str:
+        return hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+
+    def evict_expired(self):
+        cutoff = time.monotonic() - self.ttl
+        for scan_id, session in list(self.sessions.items()):
+            if session.done and session.touched < cutoff:
+                del self.sessions[scan_id]
+
+    def start(self, access_token: str, frames: AsyncIterator[str]) -> ScanSession:
+        """Run `frames` (an SSE generator) in the background as a new session."""
+        self.evict_expired()
+        session = ScanSession(self.owner_key(access_token))
+        session.task = asyncio.create_task(session.run(frames))
+        self.sessions[session.scan_id] = session
+        return session
+
+    def resume(
+        self, last_event_id: Optional[str], access_token: str
+    ) -> Tuple[Optional[ScanSession], int]:
+        """Find the session a Last-Event-ID belongs to. Returns (None, 0) when
+        the ID is malformed, expired or was issued for a different token."""
+        self.evict_expired()
+        if not last_event_id:
+            return None, 0
+
+        scan_id, _, seq = last_event_id.partition(":")
+        session = self.sessions.get(scan_id)
+        if session is None or session.owner != self.owner_key(access_token):
+            return None, 0
+        try:
+            after_seq = int(seq)
+        except ValueError:
+            return None, 0
+        return session, min(max(after_seq, 0), len(session.frames))
+
+
+scan_sessions = ScanSessionManager()
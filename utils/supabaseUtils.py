@@ -1,6 +1,6 @@
 import os
-from supabase import create_client, Client
-from postgrest import APIError
+import httpx
+from postgrest import APIError, AsyncPostgrestClient, SyncPostgrestClient
 from dotenv import load_dotenv
 from supabase import acreate_client, AsyncClient
 
@@ -10,18 +10,70 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
+# "fake" runs against the in-memory stand-in in fakes.fakeSupabase
+SUPABASE_BACKEND = os.getenv("SUPABASE_BACKEND", "supabase")
 print("The new URL", SUPABASE_URL)
-supabaseSync: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-supabaseAnonSync: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
 
 
-def fetchEpisodes(access_token):
+SUPABASE_REST_URL = f"{SUPABASE_URL}/rest/v1"
+_rest_transport: httpx.AsyncHTTPTransport | None = None
+
+
+def user_rest_headers(access_token: str) -> dict:
+    """PostgREST headers that run queries as the token's user (RLS applies)."""
+    return {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        "apikey": SUPABASE_ANON_KEY or "",
+        "Authorization": f"Bearer {access_token}",
+    }
+
 
-    supabaseAnonSync.postgrest.session.headers.update(
-        {"Authorization": f"Bearer {access_token}"}
+class ScopedPostgrestClient(AsyncPostgrestClient):
+    """
+    PostgREST client bound to one user's access token. Each request gets its
+    own client (and headers), but all of them share one connection pool.
+    """
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None):
+        global _rest_transport
+        if _rest_transport is None:
+            _rest_transport = httpx.AsyncHTTPTransport(http2=True)
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            transport=_rest_transport,
+            follow_redirects=True,
+        )
+
+    async def aclose(self) -> None:
+        pass  # The shared pool outlives the request; see close_rest_transport
+
+
+def scoped_postgrest(access_token: str) -> ScopedPostgrestClient:
+    if SUPABASE_BACKEND == "fake":
+        # The fake has no row level security; callers filter by user anyway
+        return supabase_func_instance.supabase
+    return ScopedPostgrestClient(
+        SUPABASE_REST_URL, headers=user_rest_headers(access_token)
     )
 
-    supabase_response = supabaseAnonSync.table("episodes").select("*").execute()
+
+async def close_rest_transport():
+    global _rest_transport
+    if _rest_transport is not None:
+        await _rest_transport.aclose()
+        _rest_transport = None
+
+
+def fetchEpisodes(access_token):
+    # A client per call: updating the shared client's headers let concurrent
+    # users read with each other's tokens
+    with SyncPostgrestClient(
+        SUPABASE_REST_URL, headers=user_rest_headers(access_token)
+    ) as client:
+        supabase_response = client.table("episodes").select("*").execute()
     # supabase_response = (
     #     supabase.table("NotesFunctionCall").select("*").eq("userID", user_id).execute()
     # )
@@ -99,6 +151,28 @@ class SupaBaseFunc:
             print(f"Error fetching flag value: {e}")
             return None
 
+    async def get_sender_cache(self, mailbox: str):
+        """
+        Fetch the persisted sender scan state for a Gmail mailbox.
+
+        Rows live in `sender_scan_cache` (mailbox text primary key,
+        history_id text, senders jsonb).
+        """
+        try:
+            response = (
+                await self.supabase.table("sender_scan_cache")
+                .select("mailbox, history_id, senders")
+                .eq("mailbox", mailbox)
+                .limit(1)
+                .execute()
+            )
+            if response.data:
+                return response.data[0]
+            return None
+        except Exception as e:
+            print(f"Error fetching sender cache: {e}")
+            return None
+
     async def getUserId(self, accessToken):
         token = accessToken
         try:
@@ -183,13 +257,10 @@ class SupaBaseFunc:
             return None
 
     async def fetchNotes(self, access_token):
-        self.supabaseAnon.postgrest.session.headers.update(
-            {"Authorization": f"Bearer {access_token}"}
-        )
-
         try:
             notesData = (
-                await self.supabase.table("NotesFunctionCall")
+                await scoped_postgrest(access_token)
+                .table("NotesFunctionCall")
                 .select("*")  # ✅ No need to filter by userID explicitly
                 .execute()
             )
@@ -209,5 +280,12 @@ async def init_global_instance():
     """
     global supabase_func_instance
     if supabase_func_instance is None:
-        supabase_func_instance = await SupaBaseFunc.create()
+        if SUPABASE_BACKEND == "fake":
+            from fakes.fakeSupabase import FakeSupabase
+
+            fake = FakeSupabase()
+            supabase_func_instance = SupaBaseFunc(fake, fake)
+            print("⚠️ Using the in-memory fake Supabase backend")
+        else:
+            supabase_func_instance = await SupaBaseFunc.create()
     return supabase_func_instance
@@ -0,0 +1,65 @@
+import math
+import os
+import re
+from typing import List
+
+from dotenv import load_dotenv
+
+from utils.tokenCount import token_counter
+
+load_dotenv()
+
+# Inputs above this many tokens are refined in chunks of at most this size
+REFINE_CHUNK_TOKENS = int(os.getenv("REFINE_CHUNK_TOKENS", "6000"))
+
+# parsed_text has its whitespace collapsed by clean_text, so paragraph breaks
+# are gone; sentence ends are the finest boundary left that keeps wording intact
+SENTENCE_END_RE = re.compile(
+    r"(?:(?<=[.!?…])|(?<=[.!?…][\"'”’)\]]))\s+(?=[\"'“‘(\[]?[A-Z0-9])"
+)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s for s in SENTENCE_END_RE.split(text) if s]
+
+
+def split_words(sentence: str, tokens: int, budget: int) -> List[str]:
+    """Cut a sentence longer than `budget` into equal word runs that fit."""
+    words = sentence.split(" ")
+    parts = math.ceil(tokens / budget)
+    size = math.ceil(len(words) / parts)
+    return [" ".join(words[i : i + size]) for i in range(0, len(words), size)]
+
+
+async def chunk_text(
+    text: str, model: str, budget: int = REFINE_CHUNK_TOKENS
+) -> List[str]:
+    """
+    Split `text` into consecutive chunks of at most about `budget` tokens,
+    breaking only between sentences unless one sentence alone is too long.
+    Text within budget comes back as a single chunk.
+    """
+    # Cheap pre-screen: most newsletters are far below the budget
+    if token_counter.estimate(text) <= budget // 2:
+        return [text]
+    if await token_counter.count_async(text, model) <= budget:
+        return [text]
+
+    sentences = split_sentences(text)
+    counts = await token_counter.count_batch(sentences, model)
+
+    chunks, current, current_tokens = [], [], 0
+    for sentence, tokens in zip(sentences, counts):
+        pieces = [sentence]
+        if tokens > budget:
+            pieces = split_words(sentence, tokens, budget)
+            tokens = math.ceil(tokens / len(pieces))
+        for piece in pieces:
+            if current and current_tokens + tokens > budget:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
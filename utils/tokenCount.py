@@ -1,4 +1,141 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
 import tiktoken
+from dotenv import load_dotenv
+
+from utils.metrics import metrics
+
+load_dotenv()
+
+TOKEN_COUNT_THREADS = int(os.getenv("TOKEN_COUNT_THREADS", "4"))
+# Shorter texts are counted on the calling thread; a hop costs more than that
+TOKEN_COUNT_INLINE_CHARS = int(os.getenv("TOKEN_COUNT_INLINE_CHARS", "2000"))
+# Average characters per token for English prose with the GPT-4o tokenizers
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4"))
+FALLBACK_ENCODING = "cl100k_base"
+# Seconds before retrying an encoding that failed to load
+TOKENIZER_RETRY = float(os.getenv("TOKENIZER_RETRY", "60"))
+
+
+class TokenCounter:
+    """
+    Token counting with the tokenizer loaded once per encoding.
+
+    `count_async` and `count_batch` run tiktoken on a shared thread pool
+    (tiktoken releases the GIL while encoding), so long newsletters don't
+    block the event loop. `estimate` is a length-based guess for
+    pre-screening that needs no tokenizer at all. If an encoding can't be
+    loaded (tiktoken downloads it on first use), counts fall back to the
+    estimate until a retry after TOKENIZER_RETRY seconds succeeds.
+    """
+
+    def __init__(self, threads: int = TOKEN_COUNT_THREADS):
+        self.threads = max(1, threads)
+        self.encodings: Dict[str, tiktoken.Encoding] = {}  # {model: encoding}
+        self.failed_at: Dict[str, float] = {}  # {model: monotonic time}
+        self.lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def encoding(self, model: str) -> Optional[tiktoken.Encoding]:
+        encoding = self.encodings.get(model)
+        if encoding is not None:
+            return encoding
+        failed_at = self.failed_at.get(model)
+        if failed_at is not None and time.monotonic() - failed_at < TOKENIZER_RETRY:
+            return None
+
+        with self.lock:
+            if model not in self.encodings:
+                try:
+                    try:
+                        encoding = tiktoken.encoding_for_model(model)
+                    except KeyError:
+                        # Fallback for unsupported models
+                        encoding = tiktoken.get_encoding(FALLBACK_ENCODING)
+                except Exception as e:
+                    print(f"❌ Could not load tokenizer for {model}, estimating: {e}")
+                    self.failed_at[model] = time.monotonic()
+                    return None
+                self.encodings[model] = encoding
+        return self.encodings[model]
+
+    def load(self, models: Iterable[str]):
+        """Load the encodings for `models` ahead of the first request."""
+        for model in models:
+            self.encoding(model)
+
+    async def warm_up(self, models: Iterable[str]):
+        await asyncio.get_running_loop().run_in_executor(
+            self.executor(), self.load, list(models)
+        )
+
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.threads, thread_name_prefix="token-count"
+            )
+        return self._executor
+
+    @staticmethod
+    def estimate(text: str) -> int:
+        """Rough token count from the text length alone."""
+        if not text:
+            return 0
+        return max(1, round(len(text) / CHARS_PER_TOKEN))
+
+    def count(self, text: str, model: str = "gpt-4o") -> int:
+        """Exact token count of `text` on the calling thread."""
+        encoding = self.encoding(model)
+        if encoding is None:
+            metrics.incr("tokens.estimated")
+            return self.estimate(text)
+        return len(encoding.encode_ordinary(text))
+
+    def count_many(self, texts: List[str], model: str) -> List[int]:
+        return [self.count(text, model) for text in texts]
+
+    async def count_async(self, text: str, model: str = "gpt-4o") -> int:
+        if len(text) < TOKEN_COUNT_INLINE_CHARS and model in self.encodings:
+            return self.count(text, model)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor(), self.count, text, model
+        )
+
+    async def count_batch(self, texts: List[str], model: str = "gpt-4o") -> List[int]:
+        """
+        Token counts for `texts`, in order. The texts are split into one slice
+        per pool thread and encoded in parallel. (tiktoken's own
+        encode_ordinary_batch starts a new thread pool on every call.)
+        """
+        if not texts:
+            return []
+        if sum(map(len, texts)) < TOKEN_COUNT_INLINE_CHARS and model in self.encodings:
+            return self.count_many(texts, model)
+
+        loop = asyncio.get_running_loop()
+        size = -(-len(texts) // self.threads)  # Ceiling division
+        slices = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self.executor(), self.count_many, texts[i : i + size], model
+                )
+                for i in range(0, len(texts), size)
+            )
+        )
+        return [count for counts in slices for count in counts]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+token_counter = TokenCounter()
 
 
 def count_tokens(text: str, model: str = "gpt-4o") -> int:
@@ -10,12 +147,4 @@ def count_tokens(text: str, model: str = "gpt-4o") -> int:
                   Other options: "gpt-4", "gpt-3.5-turbo", etc.
     :return: The number of tokens in the input text.
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding(
-            "cl100k_base"
-        )  # Fallback for unsupported models
-
-    token_count = len(encoding.encode(text))
-    return token_count
+    return token_counter.count(text, model)
@@ -0,0 +1,169 @@
+import asyncio
+import os
+from typing import Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from utils.mailManager import mail_manager
+from utils.metrics import metrics
+from utils.saveEmailUtil import is_transient
+
+load_dotenv()
+
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "50"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.5"))  # Seconds
+# Flushes a row may wait for its record to become visible before it is dropped
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "6"))
+
+
+class WriteBehindBuffer:
+    """
+    Coalesces per-record column updates into batched writes.
+
+    `update` only records the new values; later updates for the same record
+    replace earlier ones. Pending rows are written every `interval` seconds,
+    or as soon as `max_rows` are waiting, as one update per record keyed on
+    the key column, all sent together. Only the buffered columns are sent, so
+    a flush never rewrites or resurrects the rest of the row. Records not
+    visible yet (the update matched nothing) are requeued for the next flush,
+    up to WRITE_BEHIND_MAX_ATTEMPTS times, after which `on_failure(user_id)`
+    is called, as it is for permanent errors.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        key: str = "id",
+        max_rows: int = WRITE_BEHIND_MAX_ROWS,
+        interval: float = WRITE_BEHIND_INTERVAL,
+        on_failure: Optional[Callable[[str], None]] = None,
+    ):
+        self.table = table
+        self.key = key
+        self.max_rows = max_rows
+        self.interval = interval
+        self.on_failure = on_failure
+        self.pending: Dict[str, dict] = {}  # {record_id: {values, user_id, attempts}}
+        self.lock = asyncio.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes = set()  # Timer-started flush tasks, referenced until done
+
+    async def update(self, record_id: str, values: dict, user_id: str = None):
+        record_id = str(record_id)
+        entry = self.pending.get(record_id)
+        if entry is None:
+            self.pending[record_id] = {
+                "values": dict(values),
+                "user_id": user_id,
+                "attempts": 0,
+            }
+        else:
+            entry["values"].update(values)
+
+        if len(self.pending) >= self.max_rows:
+            self.schedule(0)
+        else:
+            self.schedule(self.interval)
+
+    def schedule(self, delay: float):
+        if self._timer is not None:
+            if delay:
+                return  # A flush is already due
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        """Write up to `max_rows` pending rows; reschedule if more remain."""
+        self._timer = None
+        async with self.lock:
+            record_ids = list(self.pending)[: self.max_rows]
+            entries = {rid: self.pending.pop(rid) for rid in record_ids}
+            if entries:
+                await self.write(entries)
+        if self.pending and self._timer is None:
+            self.schedule(0 if len(self.pending) >= self.max_rows else self.interval)
+
+    async def write(self, entries: Dict[str, dict]):
+        results = await asyncio.gather(
+            *(self.write_row(rid, e["values"]) for rid, e in entries.items()),
+            return_exceptions=True,
+        )
+
+        written, missing, transient, failed = set(), {}, {}, {}
+        for (record_id, entry), result in zip(entries.items(), results):
+            if isinstance(result, Exception):
+                print(f"❌ Write-behind update of record {record_id} failed: {result}")
+                target = transient if is_transient(result) else failed
+                target[record_id] = entry
+            elif result:
+                written.add(record_id)
+            else:
+                missing[record_id] = entry
+
+        metrics.incr("write_behind.rows", len(written))
+        metrics.incr("write_behind.flushes")
+        print(f"✅ Write-behind flushed {len(written)} rows to {self.table}")
+        self.requeue({**missing, **transient})
+        self.fail(failed)
+
+    async def write_row(self, record_id: str, values: dict) -> bool:
+        """Update one record's buffered columns; False if no row matched."""
+        from utils.supabaseUtils import supabase_func_instance
+
+        response = (
+            await supabase_func_instance.supabase.table(self.table)
+            .update(values)
+            .eq(self.key, record_id)
+            .execute()
+        )
+        return bool(response.data)
+
+    def requeue(self, entries: Dict[str, dict]):
+        for record_id, entry in entries.items():
+            entry["attempts"] += 1
+            if entry["attempts"] >= WRITE_BEHIND_MAX_ATTEMPTS:
+                self.fail({record_id: entry})
+                continue
+            if record_id in self.pending:
+                # Keep values buffered since this flush started
+                entry["values"].update(self.pending[record_id]["values"])
+            self.pending[record_id] = entry
+            metrics.incr("write_behind.requeued")
+
+    def fail(self, entries: Dict[str, dict]):
+        for record_id, entry in entries.items():
+            print(f"❌ Dropping buffered update for record {record_id}")
+            metrics.incr("write_behind.dropped")
+            if self.on_failure and entry["user_id"]:
+                self.on_failure(entry["user_id"])
+
+    async def aclose(self):
+        """Flush everything still pending, giving requeued rows one last try."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._flushes:
+            await asyncio.gather(*list(self._flushes), return_exceptions=True)
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        while self.pending:
+            for entry in self.pending.values():
+                entry["attempts"] = max(
+                    entry["attempts"], WRITE_BEHIND_MAX_ATTEMPTS - 1
+                )
+            await self.flush()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+refined_text_writes = WriteBehindBuffer(
+    "user_news_letters",
+    on_failure=lambda user_id: mail_manager.reduce_user_mail(userID=user_id),
+)